@@ -0,0 +1,740 @@
+import os
+import random
+import time
+import tracemalloc
+import argparse
+import concurrent.futures
+
+from gomoku import Gomoku
+from playout import random_playouts, lockstep_playouts
+import minimax
+import minimax_genetic
+import transposition
+import search
+import threat_space
+import tactics
+import mcts_uct0
+import mcts_uct0_tree_parallel
+import mcts_uct0_enhanced
+import mcts_uct2
+import mcts_uct2_enhanced
+import mcts_soa
+import state_table
+import rollout_pool
+
+# Throughput comparisons between implementations, run with
+#   python benchmark.py <benchmark> [--seconds S] [--board_size N] [--games G] [--move_time T]
+
+def random_games(game, seconds):
+    """Plays uniformly random games until the time is up.
+    Returns (games finished, successor calls) for the run."""
+
+    games = 0
+    moves = 0
+    end_time = time.time() + seconds
+    while time.time() < end_time:
+        pos = game.initial_state()
+        while not pos.is_terminal():
+            pos = pos.successor(random.choice(pos.get_actions()))
+            moves += 1
+        games += 1
+    return games, moves
+
+
+def check_same_games(board_size, games):
+    """Plays the same random games with both State classes and checks that they agree."""
+
+    for i in range(games):
+        seed = random.random()
+        results = []
+        for bitboard in (False, True):
+            rng = random.Random(seed)
+            pos = Gomoku(board_size, bitboard).initial_state()
+            history = []
+            while not pos.is_terminal():
+                actions = pos.get_actions()
+                history.append(actions)
+                pos = pos.successor(rng.choice(actions))
+            results.append((history, pos.board(), pos.payoff()))
+        if results[0] != results[1]:
+            raise AssertionError('State and BitState disagree on game %d' % i)
+
+
+def bench_states(args):
+    """Compares Gomoku.State with Gomoku.BitState on random games"""
+
+    check_same_games(args.board_size, 20)
+    rates = []
+    for name, bitboard in (("State", False), ("BitState", True)):
+        games, moves = random_games(Gomoku(args.board_size, bitboard), args.seconds)
+        rates.append(moves / args.seconds)
+        print(f"{name:>10}: {games / args.seconds:10.1f} games/s {moves / args.seconds:12.1f} moves/s")
+    print(f"   speedup: {rates[1] / rates[0]:.2f}x")
+
+
+def successor_rollout(pos):
+    """A rollout through State.successor, as the MCTS modules did before playout.py"""
+
+    while not pos.is_terminal():
+        pos = pos.successor(random.choice(pos.get_actions()))
+    return pos.payoff()
+
+
+def count_rollouts(rollout, seconds):
+    """Runs rollout() until the time is up and returns the number of calls and the mean payoff"""
+
+    count = 0
+    total = 0
+    end_time = time.time() + seconds
+    while time.time() < end_time:
+        total += rollout()
+        count += 1
+    return count, total / count
+
+
+def bench_rollouts(args):
+    """Compares successor() rollouts with the playout engine, from the initial state and
+    from a position a few random moves in"""
+
+    game = Gomoku(args.board_size)
+    starts = [game.initial_state()]
+    pos = starts[0]
+    for i in range(6):
+        pos = pos.successor(random.choice(pos.get_actions()))
+    starts.append(pos)
+
+    for start in starts:
+        print(f"from position with {sum(space != -1 for row in start.board() for space in row)} stones:")
+        rates = []
+        for name, rollout in (("successor", lambda: successor_rollout(start)),
+                              ("engine", lambda: random_playouts(start)[0]),
+                              ("engine x64", lambda: sum(random_playouts(start, 64)) / 64)):
+            count, mean = count_rollouts(rollout, args.seconds)
+            if name == "engine x64":
+                count *= 64
+            rates.append(count / args.seconds)
+            print(f"{name:>12}: {count / args.seconds:10.1f} rollouts/s   mean payoff {mean:+.3f}")
+        print(f"     speedup: {rates[1] / rates[0]:.1f}x single, {rates[2] / rates[0]:.1f}x batched")
+
+
+def bench_lockstep(args):
+    """Compares rollouts per second for one leaf: 4 rollouts on a fresh thread pool as the enhanced
+    agents did, K rollouts on the playout engine, and K rollouts in lockstep with NumPy"""
+
+    pos = Gomoku(args.board_size).initial_state()
+    for i in range(4):
+        pos = pos.successor(random.choice(pos.get_actions()))
+
+    def threaded():
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [executor.submit(random_playouts, pos) for _ in range(4)]
+            return sum(future.result()[0] for future in futures) / 4
+
+    count, mean = count_rollouts(threaded, args.seconds)
+    print(f"{'threads x4':>14}: {4 * count / args.seconds:10.1f} rollouts/s   mean payoff {mean:+.3f}")
+    for k in (16, 64, 256, 1024):
+        for name, playouts in (("engine", random_playouts), ("lockstep", lockstep_playouts)):
+            count, mean = count_rollouts(lambda: sum(playouts(pos, k)) / k, args.seconds)
+            print(f"{name + ' x' + str(k):>14}: {k * count / args.seconds:10.1f} rollouts/s   mean payoff {mean:+.3f}")
+
+
+def random_positions(board_size, count):
+    """Returns count nonterminal positions from random games"""
+
+    positions = []
+    while len(positions) < count:
+        pos = Gomoku(board_size).initial_state()
+        while not pos.is_terminal() and len(positions) < count:
+            positions.append(pos)
+            pos = pos.successor(random.choice(pos.get_actions()))
+    return positions
+
+
+def bench_heuristic(args):
+    """Compares minimax.scan_heuristic with the line table lookup in minimax.heuristic"""
+
+    positions = random_positions(args.board_size, 2000)
+    for pos in positions:
+        if minimax.heuristic(pos) != minimax.scan_heuristic(pos):
+            raise AssertionError('heuristic values differ')
+
+    rates = []
+    for name, heuristic in (("scan", minimax.scan_heuristic), ("table", minimax.heuristic)):
+        calls = 0
+        end_time = time.time() + args.seconds
+        while time.time() < end_time:
+            for pos in positions[:100]:
+                heuristic(pos)
+            calls += 100
+        rates.append(calls / args.seconds)
+        print(f"{name:>6}: {calls / args.seconds:10.1f} calls/s")
+    print(f"speedup: {rates[1] / rates[0]:.1f}x")
+
+
+def scan_greedy(state):
+    """minimax.greedy as it was before Position and the incremental evaluator"""
+
+    factor = 1 if state.actor() == 0 else -1
+    best_val = None
+    best_action = None
+    for action in state.get_actions():
+        val = minimax.scan_heuristic(state.successor(action))
+        if best_val is None or val * factor > best_val:
+            best_val = val * factor
+            best_action = action
+    return best_action
+
+
+def check_evaluator(positions):
+    """Plays and takes back random moves on each position, checking after every step that the
+    evaluator's running total matches minimax.scan_heuristic up to rounding"""
+
+    for state in positions:
+        pos = state.position()
+        evaluator = minimax.LINE_TABLE.evaluator(pos.board())
+        start = pos.stones_played()
+        for i in range(40):
+            if pos.stones_played() > start and (pos.is_terminal() or random.random() < 0.4):
+                minimax.undo(pos, evaluator)
+            elif not pos.is_terminal():
+                minimax.play(pos, evaluator, random.choice(pos.get_actions()))
+            if not pos.is_terminal():
+                expected = minimax.scan_heuristic(pos)
+                if abs(evaluator.value() - expected) > 1e-9 * max(1, abs(expected)):
+                    raise AssertionError(f'evaluator value {evaluator.value()} differs from scan_heuristic {expected}')
+
+
+def check_genetic_greedy(positions):
+    """Checks that minimax_genetic.greedy, whose weight vectors only weigh runs of up to four,
+    plays a winning move whenever the position has one"""
+
+    weight_rows = [1, 5.380144337410294, 46.81350414753168, 3928.1614264827967]
+    weight_space = [1, 1.6266102619854206, 2.0229625144202052, 2.9902217791604953, 2.3881491832469295,
+                    1.5511375752385905, 1.964499139404]
+    wins = 0
+    for pos in positions:
+        action = minimax_genetic.greedy(pos, weight_rows, weight_space)
+        winning = [move for move in pos.get_actions() if pos.successor(move).winner == pos.actor()]
+        if winning:
+            wins += 1
+            if action not in winning:
+                raise AssertionError(f'genetic greedy missed a win:\n{pos}')
+    return wins
+
+
+def bench_greedy(args):
+    """Compares greedy move selection by successor() and scan_heuristic with minimax.greedy,
+    which plays moves on a Position and rescores only the lines through each move"""
+
+    positions = random_positions(args.board_size, 300)
+    # The evaluator's running total only matches scan_heuristic up to rounding, so moves within
+    # rounding of each other may be picked differently; the moves picked must be worth the same
+    for pos in positions[:100]:
+        factor = 1 if pos.actor() == 0 else -1
+        expected = factor * minimax.scan_heuristic(pos.successor(scan_greedy(pos)))
+        val = factor * minimax.scan_heuristic(pos.successor(minimax.greedy(pos)))
+        if abs(val - expected) > 1e-9 * max(1, abs(expected)):
+            raise AssertionError('greedy moves differ')
+    check_evaluator(positions[:100])
+    check_genetic_greedy(positions)
+
+    rates = []
+    for name, greedy in (("scan", scan_greedy), ("incremental", minimax.greedy)):
+        calls = 0
+        end_time = time.time() + args.seconds
+        while time.time() < end_time:
+            greedy(positions[calls % len(positions)])
+            calls += 1
+        rates.append(calls / args.seconds)
+        print(f"{name:>12}: {calls / args.seconds:10.1f} moves/s")
+    print(f"     speedup: {rates[1] / rates[0]:.1f}x")
+
+
+def search_values(state, depth, context):
+    """Values for player 0 of every move from state, searched to a fixed depth as one iteration
+    of minimax.minimax does"""
+
+    pos = state.position()
+    evaluator = minimax.LINE_TABLE.evaluator(pos.board())
+    values = []
+    for action in pos.get_actions():
+        minimax.play(pos, evaluator, action)
+        values.append(minimax.alphabeta(pos, depth, minimax.START_ALPHA, minimax.START_BETA, evaluator, context))
+        minimax.undo(pos, evaluator)
+    return values
+
+
+def compare_searches(positions, depths, configurations):
+    """Searches every position to each depth with each (name, make search context) configuration,
+    checking that they give the same values, and prints the time and nodes searched"""
+
+    for depth in depths:
+        expected = None
+        for name, make_context in configurations:
+            nodes = 0
+            start = time.time()
+            for pos in positions:
+                context = make_context()
+                values = search_values(pos, depth, context)
+                nodes += context.nodes
+            elapsed = time.time() - start
+            if expected is None:
+                expected = values
+            elif values != expected:
+                raise AssertionError(f'values differ with {name}')
+            print(f"depth {depth} {name:>18}: {elapsed:8.2f} s {nodes / len(positions):12.1f} nodes/position   {context.stats()}")
+
+
+def bench_transposition(args):
+    """Compares fixed depth alphabeta searches with and without a transposition table"""
+
+    positions = random_positions(args.board_size, 40)[10::3]
+    configurations = (("no table", lambda: search.Search(None, ordering=False, lmr=False)),
+                      ("table", lambda: search.Search(transposition.TranspositionTable(), ordering=False, lmr=False)))
+    compare_searches(positions, (1, 2), configurations)
+    # up to depth 2 the only positions reached twice are leaves, which are counted before the
+    # table is probed, so the nodes saved only show from depth 3
+    compare_searches(positions[:2], (3,), configurations)
+
+
+def bench_ordering(args):
+    """Compares fixed depth alphabeta searches in row-major order with searches that try the table
+    move, killer moves and history scores first"""
+
+    positions = random_positions(args.board_size, 40)[10::3]
+    compare_searches(positions, (1, 2), (("row-major", lambda: search.Search(transposition.TranspositionTable(), ordering=False, lmr=False)),
+                                         ("ordered", lambda: search.Search(transposition.TranspositionTable(), lmr=False))))
+
+    # Iterative deepening as minimax.minimax does it, where ordering gets to use the earlier iterations
+    for ordering in (False, True):
+        nodes = [0, 0, 0]
+        start = time.time()
+        for state in positions[:4]:
+            context = search.Search(transposition.TranspositionTable(), ordering, lmr=False)
+            for depth in range(3):
+                before = context.nodes
+                search_values(state, depth + 1, context)
+                nodes[depth] += context.nodes - before
+        print(f"iterative deepening to depth 3, {'ordered' if ordering else 'row-major'}: {time.time() - start:.2f} s, "
+              f"nodes per depth {nodes}, effective branching factor {nodes[2] / nodes[1]:.1f}")
+
+
+def bench_pvs(args):
+    """Compares iterative deepening to a fixed depth with full windows at every move, with principal
+    variation search, and with principal variation search and aspiration windows"""
+
+    positions = random_positions(args.board_size, 60)[5::5]
+    expected = None
+    for name, options in (("full windows", dict(pvs=False, aspiration=None, lmr=False)),
+                          ("pvs", dict(aspiration=None, lmr=False)),
+                          ("pvs + aspiration", dict(lmr=False))):
+        nodes = 0
+        researches = 0
+        start = time.time()
+        moves = []
+        for state in positions:
+            context = search.Search(transposition.TranspositionTable(), **options)
+            moves.append(minimax.minimax(state, float("inf"), context=context, max_depth=3))
+            nodes += context.nodes
+            researches += context.researches
+        if expected is None:
+            expected = moves
+        elif moves != expected:
+            raise AssertionError(f'moves differ with {name}')
+        print(f"{name:>16}: {time.time() - start:8.2f} s {nodes / len(positions):12.1f} nodes/position "
+              f"{researches / len(positions):8.1f} re-searches/position")
+
+
+def bench_selective(args):
+    """Compares the depth minimax.minimax reaches in the same time with full width search, with
+    late move reductions, and with late move reductions and top-K pruning"""
+
+    positions = random_positions(args.board_size, 60)[5::5]
+    for name, options in (("full width", dict(lmr=False)),
+                          ("lmr", dict()),
+                          ("lmr + top 8", dict(top_k=8))):
+        depths = []
+        for state in positions:
+            context = search.Search(transposition.TranspositionTable(), **options)
+            minimax.minimax(state, args.seconds / len(positions), context=context)
+            depths.append(context.depth)
+        print(f"{name:>12}: mean depth {sum(depths) / len(depths):5.2f}, depths {depths}")
+
+
+def bench_threats(args):
+    """Runs the threat-space solver with fours only (VCF) and with threes (VCT) on positions from
+    games where each move is greedy or random, reporting how many wins it proves and how long it takes"""
+
+    positions = []
+    while len(positions) < 200:
+        pos = Gomoku(args.board_size).initial_state()
+        while not pos.is_terminal() and len(positions) < 200:
+            positions.append(pos)
+            pos = pos.successor(random.choice([minimax.greedy(pos), random.choice(pos.get_actions())]))
+
+    # Solving from a mutable Gomoku.Position must prove the same wins and leave it unchanged
+    for pos in positions[::10]:
+        mutable = pos.position()
+        key = mutable.key
+        line = threat_space.solve(mutable, max_nodes=threat_space.POLICY_MAX_NODES)
+        if (line is None) != (threat_space.solve(pos, max_nodes=threat_space.POLICY_MAX_NODES) is None) or mutable.key != key:
+            raise AssertionError(f"solving from a Position differs from solving from its state:\n{pos}")
+
+    for name, vct in (("VCF", False), ("VCT", True)):
+        times = []
+        wins = 0
+        for pos in positions:
+            start = time.time()
+            line = threat_space.solve(pos, vct=vct, max_nodes=threat_space.POLICY_MAX_NODES)
+            times.append(time.time() - start)
+            wins += line is not None
+        times.sort()
+        print(f"{name}: {wins}/{len(positions)} wins proven, mean {1000 * sum(times) / len(times):7.2f} ms, "
+              f"max {1000 * times[-1]:7.2f} ms")
+
+
+def bench_tactics(args):
+    """On positions with a win, a five to block or an open four to make, compares the time
+    tactics.tactical_move takes with how often uct0 (0.2 s per move) and greedy play a move of the
+    same kind"""
+
+    positions = []
+    for pos in random_positions(args.board_size, 400):
+        action, reason = tactics.tactical_move(pos)
+        if action is not None:
+            positions.append((pos, reason))
+
+    start = time.time()
+    for pos, reason in positions:
+        tactics.tactical_move(pos)
+    print(f"tactical_move: {1000 * (time.time() - start) / len(positions):.3f} ms per position")
+
+    for name, policy in (("uct0", mcts_uct0.mcts_policy(0.2)), ("greedy", minimax.greedy)):
+        agrees = tactics.Counter()
+        totals = tactics.Counter()
+        for pos, reason in positions[:30]:
+            action = policy(pos)
+            # the same kind of move if it wins, blocks a five of the opponent, or makes an open four
+            board = threat_space.ThreatBoard(pos)
+            if reason == "win":
+                agrees[reason] += pos.successor(action).is_terminal()
+            elif reason == "block":
+                agrees[reason] += action in board.five_cells(1 - pos.actor())
+            else:
+                agrees[reason] += action in board.open_four_cells(pos.actor())
+            totals[reason] += 1
+        print(f"{name:>6}: " + ", ".join(f"{reason} {agrees[reason]}/{totals[reason]}" for reason in totals))
+
+
+def bench_root_parallel(args):
+    """Root parallel uct0 with 1, 2, 4 and 8 worker processes: rollouts per second over all workers,
+    and win rate against single tree uct0 with the same time per move"""
+
+    # test_gomoku and genetic import each other, and only work when genetic is imported first
+    import genetic
+    from test_gomoku import compare_policies
+
+    pos = Gomoku(args.board_size).initial_state()
+    for i in range(4):
+        pos = pos.successor(random.choice(pos.get_actions()))
+    # start the pools before timing anything
+    for workers in (1, 2, 4, 8):
+        mcts_uct0.root_parallel_search(pos, 0.01, workers)
+
+    print(f"{os.cpu_count()} cpus")
+    for workers in (1, 2, 4, 8):
+        playouts = 0
+        start = time.time()
+        while time.time() - start < args.seconds:
+            playouts += mcts_uct0.root_parallel_search(pos, 0.5, workers)[1]
+        rate = playouts / (time.time() - start)
+        margin, wins = compare_policies(Gomoku(args.board_size), lambda: mcts_uct0.mcts_policy(args.move_time, workers),
+                                        lambda: mcts_uct0.mcts_policy(args.move_time), args.games, 1.0,
+                                        args.move_time, args.move_time, False)
+        print(f"{workers} workers: {rate:10.1f} rollouts/s, won {100 * wins:5.1f}% of {args.games} games against one tree")
+
+
+def bench_tree_parallel(args):
+    """Tree parallel uct0 with 1, 2, 4 and 8 workers, with and without virtual loss: rollouts per
+    second, how often a worker steps into a node another worker is on, and how often the move
+    matches that of one worker searching four times as long (over --games positions)"""
+
+    positions = random_positions(args.board_size, 10 * args.games)[::10]
+    references = [mcts_uct0_tree_parallel.tree_parallel_search(pos, 4 * args.move_time, 1)[0] for pos in positions]
+    print(f"{os.cpu_count()} cpus, {args.move_time} s per search")
+    for workers in (1, 2, 4, 8):
+        for virtual_loss in (0, mcts_uct0_tree_parallel.VIRTUAL_LOSS):
+            playouts = 0
+            collisions = 0
+            matches = 0
+            for pos, reference in zip(positions, references):
+                action, count, collided, statistics = mcts_uct0_tree_parallel.tree_parallel_search(pos, args.move_time, workers, virtual_loss)
+                playouts += count
+                collisions += collided
+                matches += action == reference
+            print(f"{workers} workers, virtual loss {virtual_loss}: {playouts / (len(positions) * args.move_time):10.1f} rollouts/s, "
+                  f"{collisions / playouts:6.2f} collisions/rollout, same move as reference {matches}/{len(positions)}")
+
+
+def bench_rollout_pool(args):
+    """Compares rollouts per second for one leaf at a time: 4 rollouts on a fresh thread pool per
+    leaf as the enhanced agents did, and K rollouts on the persistent rollout pool with 1, 2 and 4
+    worker processes"""
+
+    pos = Gomoku(args.board_size).initial_state()
+    for i in range(4):
+        pos = pos.successor(random.choice(pos.get_actions()))
+
+    def threaded():
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [executor.submit(random_playouts, pos) for _ in range(4)]
+            return sum(future.result()[0] for future in futures) / 4
+
+    print(f"{os.cpu_count()} cpus")
+    count, mean = count_rollouts(threaded, args.seconds)
+    print(f"{'threads x4':>20}: {4 * count / args.seconds:10.1f} rollouts/s   mean payoff {mean:+.3f}")
+    for workers in (1, 2, 4):
+        pool = rollout_pool.get_pool(workers)
+        # start the workers before timing anything
+        pool.playouts(pos, workers)
+        for k in (4, 16, 64):
+            count, mean = count_rollouts(lambda: sum(pool.playouts(pos, k)[0]) / k, args.seconds)
+            print(f"{str(workers) + ' workers x' + str(k):>20}: {k * count / args.seconds:10.1f} rollouts/s   mean payoff {mean:+.3f}")
+
+
+def bench_reuse(args):
+    """For uct0 and uct0_enhanced keeping their trees between moves: the visits inherited per move
+    in self-play (--games games, --move_time per move), as a share of the root's visits once the
+    search is done, and the win rate against the same agent starting a new tree every move"""
+
+    # test_gomoku and genetic import each other, and only work when genetic is imported first
+    import genetic
+    from test_gomoku import compare_policies
+
+    for name, module in (("uct0", mcts_uct0), ("uct0_enhanced", mcts_uct0_enhanced)):
+        inherited = 0
+        visits = 0
+        moves = 0
+        for i in range(args.games):
+            position = Gomoku(args.board_size).initial_state()
+            root = None
+            while not position.is_terminal():
+                root = mcts_uct0.find_subtree(root, position) if root is not None else None
+                if root is None:
+                    root = module.Node(position)
+                inherited += root.visits
+                tree = module.MonteCarloTree(root, args.move_time)
+                position = position.successor(tree.find_move())
+                visits += root.visits
+                moves += 1
+        margin, wins = compare_policies(Gomoku(args.board_size), lambda: module.mcts_policy(args.move_time),
+                                        lambda: module.mcts_policy(args.move_time, reuse=False), args.games, 1.0,
+                                        args.move_time, args.move_time, False)
+        print(f"{name:>14}: {inherited / moves:8.1f} visits inherited per move ({100 * inherited / visits:4.1f}% of root visits), "
+              f"won {100 * wins:5.1f}% of {args.games} games against a new tree every move")
+
+
+def bench_state_table(args):
+    """uct2 with its state table capped at 0.25 and 1 megabytes and uncapped: the table's size,
+    evictions and hit rate and the peak memory traced over --games games against random play,
+    and the win rate of the capped agents against the uncapped one"""
+
+    # test_gomoku and genetic import each other, and only work when genetic is imported first
+    import genetic
+    from test_gomoku import compare_policies, random_choice
+
+    # a game at 0.1 s per move fills about 1 MB, so both caps are reached
+    for megabytes in (0.25, 1, None):
+        tracemalloc.start()
+        # one table for all the games, as if one policy played them all
+        table = state_table.StateTable(max_megabytes=megabytes)
+        for i in range(args.games):
+            position = Gomoku(args.board_size).initial_state()
+            while not position.is_terminal():
+                if position.actor() == i % 2:
+                    position = position.successor(mcts_uct2.mcts(position, args.move_time, table))
+                else:
+                    position = position.successor(random_choice(position))
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        line = f"{str(megabytes) + ' MB' if megabytes else 'no cap':>7}: peak {peak / 2 ** 20:6.1f} MB traced, table: {table.stats()}"
+        if megabytes is not None:
+            margin, wins = compare_policies(Gomoku(args.board_size), lambda: mcts_uct2.mcts_policy(args.move_time, megabytes),
+                                            lambda: mcts_uct2.mcts_policy(args.move_time, None), args.games, 1.0,
+                                            args.move_time, args.move_time, False)
+            line += f", won {100 * wins:5.1f}% of {args.games} games against no cap"
+        print(line)
+
+
+def bench_soa(args):
+    """Compares uct0's tree of Node objects with the struct of arrays tree of mcts_soa: memory per
+    node after a search of --move_time seconds, and time per UCB selection at the root against
+    its number of children"""
+
+    positions = random_positions(args.board_size, 60)[2::12]
+    print(f"{'children':>8} {'uct0 nodes':>10} {'bytes/node':>10} {'select us':>10} {'soa nodes':>10} {'bytes/node':>10} {'select us':>10}")
+    for pos in positions:
+        tracemalloc.start()
+        tree = mcts_uct0.MonteCarloTree(mcts_uct0.Node(pos), args.move_time)
+        tree.find_move()
+        uct0_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        nodes = 0
+        stack = [tree.root]
+        while stack:
+            node = stack.pop()
+            nodes += 1
+            stack.extend(node.children.values())
+        start = time.time()
+        for i in range(1000):
+            tree.calculate_action(tree.root)
+        uct0_select = (time.time() - start) * 1000
+
+        soa = mcts_soa.SoATree(pos, args.move_time)
+        soa.find_move()
+        soa_nodes = soa.nodes()
+        start = time.time()
+        for i in range(1000):
+            soa.select(0)
+        soa_select = (time.time() - start) * 1000
+        # both counts are nodes added to the search; the arrays also hold the unused rest of each block
+        print(f"{len(tree.root.children):>8} {nodes:>10} {uct0_bytes / nodes:>10.0f} {uct0_select:>10.1f} "
+              f"{soa_nodes:>10} {soa.node_bytes():>10.0f} {soa_select:>10.1f}")
+
+
+def bench_nodes(args):
+    """Compares uct0's nodes that each hold a state with the state-free MoveNodes: memory per node
+    traced over a search of --move_time seconds, and rollouts per second without tracing"""
+
+    positions = random_positions(args.board_size, 60)[2::12]
+    trees = (("state per node", lambda pos: mcts_uct0.MonteCarloTree(mcts_uct0.Node(pos), args.move_time)),
+             ("move per node", lambda pos: mcts_uct0.MoveTree(mcts_uct0.MoveNode(pos), args.move_time, pos)),
+             ("from a Position", lambda pos: mcts_uct0.MoveTree(mcts_uct0.MoveNode(pos), args.move_time, pos.position())))
+    for name, make_tree in trees:
+        nodes = 0
+        traced = 0
+        playouts = 0
+        for pos in positions:
+            tracemalloc.start()
+            tree = make_tree(pos)
+            tree.find_move()
+            traced += tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            stack = [tree.root]
+            while stack:
+                node = stack.pop()
+                nodes += 1
+                stack.extend(node.children.values())
+
+            tree = make_tree(pos)
+            tree.find_move()
+            playouts += tree.playouts
+        print(f"{name:>15}: {traced / nodes:8.0f} bytes/node over {nodes} nodes, "
+              f"{playouts / (len(positions) * args.move_time):8.1f} rollouts/s")
+
+
+def bench_uct2(args):
+    """Measures uct2's visits per second and state table entries per search of --move_time seconds
+    on positions from random games"""
+
+    positions = random_positions(args.board_size, 60)[2::12]
+    visits = 0
+    entries = 0
+    for pos in positions:
+        table = state_table.StateTable(max_megabytes=None)
+        mcts_uct2.mcts(pos, args.move_time, table)
+        visits += table[pos.key][1]
+        entries += len(table)
+    print(f"uct2: {visits / (len(positions) * args.move_time):8.1f} visits/s, {entries / len(positions):8.1f} entries per search")
+
+
+def bench_rave(args):
+    """Win rate of uct0_enhanced and uct2_enhanced, with their per-node RAVE statistics, against
+    uct0 over --games games at --move_time per move"""
+
+    # test_gomoku and genetic import each other, and only work when genetic is imported first
+    import genetic
+    from test_gomoku import compare_policies
+
+    for name, module in (("uct0_enhanced", mcts_uct0_enhanced), ("uct2_enhanced", mcts_uct2_enhanced)):
+        margin, wins = compare_policies(Gomoku(args.board_size), lambda: module.mcts_policy(args.move_time),
+                                        lambda: mcts_uct0.mcts_policy(args.move_time), args.games, 1.0,
+                                        args.move_time, args.move_time, False)
+        print(f"{name:>14}: won {100 * wins:5.1f}% of {args.games} games against uct0 (margin {margin:+.2f})")
+
+
+def bench_widening(args):
+    """Win rate of uct0 with progressive widening and heuristic priors against plain uct0, and how
+    the root's visits are spread over its children with and without widening"""
+
+    # test_gomoku and genetic import each other, and only work when genetic is imported first
+    import genetic
+    from test_gomoku import compare_policies
+
+    for widening in (False, True):
+        shares = []
+        children = []
+        for pos in random_positions(args.board_size, 60)[10::5]:
+            tree = mcts_uct0.MonteCarloTree(mcts_uct0.Node(pos), args.move_time, widening)
+            tree.find_move()
+            visits = sorted((child.visits for child in tree.root.children.values()), reverse=True)
+            shares.append(sum(visits[:3]) / sum(visits))
+            children.append(len(visits))
+        print(f"widening={widening!s:>5}: {sum(children) / len(children):5.1f} root children, "
+              f"{100 * sum(shares) / len(shares):5.1f}% of root visits on the top 3")
+
+    margin, wins = compare_policies(Gomoku(args.board_size), lambda: mcts_uct0.mcts_policy(args.move_time, widening=True),
+                                    lambda: mcts_uct0.mcts_policy(args.move_time), args.games, 1.0,
+                                    args.move_time, args.move_time, False)
+    print(f"widening: won {100 * wins:5.1f}% of {args.games} games against uct0 (margin {margin:+.2f})")
+
+
+def bench_deadline(args):
+    """Measures how long minimax.minimax takes per move against its time budget"""
+
+    positions = random_positions(args.board_size, 60)[5::5]
+    for max_time in (0.05, 0.2, 1.0):
+        times = []
+        for state in positions:
+            start = time.time()
+            minimax.minimax(state, max_time)
+            times.append(time.time() - start)
+        times.sort()
+        print(f"budget {max_time:5.2f} s: mean {sum(times) / len(times):6.3f} s, "
+              f"median {times[len(times) // 2]:6.3f} s, max {times[-1]:6.3f} s")
+
+
+BENCHMARKS = {
+    "states": bench_states,
+    "rollouts": bench_rollouts,
+    "lockstep": bench_lockstep,
+    "heuristic": bench_heuristic,
+    "greedy": bench_greedy,
+    "transposition": bench_transposition,
+    "ordering": bench_ordering,
+    "deadline": bench_deadline,
+    "pvs": bench_pvs,
+    "selective": bench_selective,
+    "threats": bench_threats,
+    "tactics": bench_tactics,
+    "root_parallel": bench_root_parallel,
+    "tree_parallel": bench_tree_parallel,
+    "rollout_pool": bench_rollout_pool,
+    "reuse": bench_reuse,
+    "state_table": bench_state_table,
+    "soa": bench_soa,
+    "nodes": bench_nodes,
+    "uct2": bench_uct2,
+    "rave": bench_rave,
+    "widening": bench_widening,
+}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Gomoku benchmarks")
+    parser.add_argument("benchmark", choices=list(BENCHMARKS))
+    parser.add_argument("--seconds", type=float, default=5.0, help="Time to run each configuration")
+    parser.add_argument("--board_size", type=int, default=11, help="Board size to benchmark on")
+    parser.add_argument("--games", type=int, default=10, help="Games to play for benchmarks that measure win rates")
+    parser.add_argument("--move_time", type=float, default=0.1, help="Time per move in those games")
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
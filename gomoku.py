@@ -1,14 +1,90 @@
 from game import Game, State
 import copy
+import random
+
+# masks and shift amounts used by BitState, cached by board size
+_BIT_LAYOUTS = {}
+
+def _bit_layout(board_size):
+    ''' Returns (stride, valid mask, direction shifts) for a bitboard of the given size.
+        Cell (x, y) is bit x * stride + y, where stride = board_size + 1 so that every
+        row ends in an always-empty guard bit that stops runs wrapping onto the next row.
+    '''
+    if board_size not in _BIT_LAYOUTS:
+        stride = board_size + 1
+        valid = 0
+        for x in range(board_size):
+            valid |= ((1 << board_size) - 1) << (x * stride)
+        # horizontal, anti-diagonal, vertical, diagonal
+        shifts = (1, stride - 1, stride, stride + 1)
+        _BIT_LAYOUTS[board_size] = (stride, valid, shifts)
+    return _BIT_LAYOUTS[board_size]
+
+# cells adjacent or diagonal to each cell, used by Position, cached by board size
+_NEIGHBORS = {}
+
+def _neighbor_table(board_size):
+    ''' Returns a list of lists holding the tuple of neighbors of each cell.
+    '''
+    if board_size not in _NEIGHBORS:
+        _NEIGHBORS[board_size] = [[tuple((n_x, n_y)
+                                         for n_x in range(max(x - 1, 0), min(x + 2, board_size))
+                                         for n_y in range(max(y - 1, 0), min(y + 2, board_size))
+                                         if n_x != x or n_y != y)
+                                   for y in range(board_size)] for x in range(board_size)]
+    return _NEIGHBORS[board_size]
+
+# random 64-bit Zobrist keys shared by every state class, cached by board size
+_ZOBRIST_KEYS = {}
+
+def _zobrist_keys(board_size):
+    ''' Returns (cell keys, turn key) for a board of the given size, where cell keys[player][x][y]
+        is XORed into a position's key when player has a stone on (x, y) and turn key is XORed in
+        when player 1 is to move.  The generator is seeded so keys are the same in every process.
+    '''
+    if board_size not in _ZOBRIST_KEYS:
+        rng = random.Random(board_size)
+        cell_keys = [[[rng.getrandbits(64) for y in range(board_size)] for x in range(board_size)] for player in range(2)]
+        _ZOBRIST_KEYS[board_size] = (cell_keys, rng.getrandbits(64))
+    return _ZOBRIST_KEYS[board_size]
+
+def _zobrist_key(board, turn):
+    ''' Computes the Zobrist key of a list of lists board from scratch.  States, BitStates and
+        Positions with the same stones and player to move all have the same key.
+    '''
+    cell_keys, turn_key = _zobrist_keys(len(board))
+    key = turn_key if turn == 1 else 0
+    for x, row in enumerate(board):
+        for y, space in enumerate(row):
+            if space != -1:
+                key ^= cell_keys[space][x][y]
+    return key
+
+def _board_str(turn, stones_played, board):
+    ans = f"{turn}, {stones_played}\n"
+    for row in board:
+        row_str = []
+        for space in row:
+            if space == -1:
+                row_str.append("\033[1;30mE")
+            elif space == 0:
+                row_str.append("\033[0;34m0")
+            else:
+                row_str.append("\033[1;33m1")
+        row_str.append("\033[0m")
+        ans += "".join(row_str) + "\n"
+    return ans
 
 class Gomoku(Game):
-    def __init__(self, board_size):
-        ''' Creates a board_size x board_size board for gomoku
+    def __init__(self, board_size, bitboard=False):
+        ''' Creates a board_size x board_size board for gomoku.  If bitboard is true then
+            initial_state returns a BitState instead of a State.
         '''
         if board_size < 0:
             raise ValueError('Board size must be positive: %d' % board_size)
         
         self.board_size = board_size
+        self.bitboard = bitboard
         # -1 for empty spaces, 0/1 for each player's pieces
         self.board = [[-1 for i in range(board_size)] for i in range(board_size)]
         self.board[board_size // 2][board_size // 2] = 0
@@ -17,11 +93,180 @@ class Gomoku(Game):
     def initial_state(self):
         ''' Creates the initial state for this board.
         '''
+        if self.bitboard:
+            return Gomoku.BitState.from_board(self.board, 1, self.stones_played)
         return Gomoku.State(self.board, 1, self.stones_played)
 
+
+    # defined before Gomoku.State so that the base class below is game.State
+    class BitState(State):
+        ''' A state that packs each player's stones into a Python int.  Exposes the same
+            interface as Gomoku.State, but successor only copies two ints and win detection
+            is done with shifts and masks over the whole board.
+        '''
+        def __init__(self, board_size, stones, turn, stones_played, key=None):
+            ''' key is the Zobrist key of the position; it is computed from stones if not given.
+            '''
+            if turn != 0 and turn != 1:
+                raise ValueError('invalid turn %d' % turn)
+
+            self._stones = stones
+            self._stones_played = stones_played
+            self._turn = turn
+            self._board_size = board_size
+            self._stride, self._valid, self._shifts = _bit_layout(board_size)
+            self._board = None
+            self.winner = None
+
+            if key is None:
+                key = _zobrist_key(self.board(), turn)
+            self.key = key
+
+        @classmethod
+        def from_board(cls, board, turn, stones_played):
+            ''' Creates a BitState from a list of lists board as used by Gomoku.State.
+            '''
+            if board is None:
+                raise ValueError('board cannot be None')
+            stride = len(board) + 1
+            stones = [0, 0]
+            for x, row in enumerate(board):
+                for y, space in enumerate(row):
+                    if space != -1:
+                        stones[space] |= 1 << (x * stride + y)
+            return cls(len(board), tuple(stones), turn, stones_played)
+
+        def is_initial(self):
+            ''' Determines if this state is the initial state.
+            '''
+            return self._stones_played == 1
+
+        def actor(self):
+            ''' Returns the index of the player who makes the next move from
+                this state.  The index will be 0 or 1.
+            '''
+            return self._turn
+
+        def _legal_mask(self):
+            # empty cells adjacent or diagonal to a stone
+            occupied = self._stones[0] | self._stones[1]
+            near = 0
+            for shift in self._shifts:
+                near |= (occupied << shift) | (occupied >> shift)
+            return near & self._valid & ~occupied
+
+        def is_legal(self, action):
+            '''
+            Determines if a given move is legal, given an x, y tuple of an action
+            '''
+            x, y = action
+            if x < 0 or y < 0 or x >= self._board_size or y >= self._board_size:
+                raise ValueError('Move out of bounds: ', str(action))
+            return (self._legal_mask() >> (x * self._stride + y)) & 1 == 1
+
+        def get_actions(self):
+            ''' Returns a list of legal moves from this state in row-major order,
+                the same order as Gomoku.State.get_actions.
+            '''
+            mask = self._legal_mask()
+            moves = []
+            while mask:
+                low = mask & -mask
+                moves.append(divmod(low.bit_length() - 1, self._stride))
+                mask ^= low
+            return moves
+
+        def check_win(self, last_action):
+            ''' Determines if the player who owns last_action has five or more in a row.
+            '''
+            x, y = last_action
+            bit = 1 << (x * self._stride + y)
+            stones = self._stones[0] if self._stones[0] & bit else self._stones[1]
+            for shift in self._shifts:
+                # pairs, then fours, then fives of consecutive stones
+                pairs = stones & (stones >> shift)
+                fours = pairs & (pairs >> (2 * shift))
+                if fours & (stones >> (4 * shift)):
+                    return True
+            return False
+
+        def successor(self, action):
+            ''' Returns the state that results from the given action
+            '''
+            if not self.is_legal(action):
+                raise ValueError('Illegal move: ', str(action))
+
+            x, y = action
+            bit = 1 << (x * self._stride + y)
+            if self._turn == 0:
+                stones = (self._stones[0] | bit, self._stones[1])
+            else:
+                stones = (self._stones[0], self._stones[1] | bit)
+            cell_keys, turn_key = _zobrist_keys(self._board_size)
+            key = self.key ^ cell_keys[self._turn][x][y] ^ turn_key
+            succ = Gomoku.BitState(self._board_size, stones, 1 - self._turn, self._stones_played + 1, key)
+
+            # if game is over, update winner
+            if succ.check_win(action):
+                succ.winner = self._turn
+            elif not succ._legal_mask():
+                succ.winner = 2
+
+            return succ
+
+        def is_terminal(self):
+            ''' Determines if this state is terminal -- whether the game is over having
+                reached this state.
+            '''
+            return self.winner is not None
+
+        def payoff(self):
+            ''' Returns the payoff to player 0 at this state: 1 for a win, 0 for a draw, -1 for
+                a loss.  The return value is None if this state is not terminal.
+            '''
+            if not self.is_terminal():
+                return None
+            elif self.winner == 2:
+                return 0
+            else:
+                return 1 if self.winner == 0 else -1
+
+        def __str__(self) -> str:
+            return _board_str(self._turn, self._stones_played, self.board())
+
+        def position(self):
+            ''' Returns a mutable Gomoku.Position for searching from this state.
+            '''
+            return Gomoku.Position.from_state(self)
+
+        def board(self):
+            ''' Returns the board as a list of lists, built on first use and cached.
+            '''
+            if self._board is None:
+                board = [[-1] * self._board_size for i in range(self._board_size)]
+                for player in (0, 1):
+                    stones = self._stones[player]
+                    while stones:
+                        low = stones & -stones
+                        x, y = divmod(low.bit_length() - 1, self._stride)
+                        board[x][y] = player
+                        stones ^= low
+                self._board = board
+            return self._board
+
+        def __hash__(self):
+            return self.key
+
+        def __eq__(self, other):
+            # compare keys first so unequal states almost never look at the stones
+            return isinstance(other, self.__class__) and self.key == other.key and self._turn == other._turn and self._stones == other._stones
+
     
     class State(State):
-        def __init__(self, board, turn, stones_played):
+        def __init__(self, board, turn, stones_played, frontier=None, key=None):
+            ''' frontier is the set of empty cells next to a stone on board and key is the
+                Zobrist key of the position; both are computed from the board if not given.
+            '''
             if board is None:
                 raise ValueError('board cannot be None')
             if turn != 0 and turn != 1:
@@ -33,7 +278,13 @@ class Gomoku(Game):
             self._board_size = len(board)
             self.winner = None
 
-            self._compute_hash()
+            if frontier is None:
+                frontier = self._compute_frontier()
+            self._frontier = frontier
+
+            if key is None:
+                key = _zobrist_key(self._board, turn)
+            self.key = key
 
             
         def is_initial(self):
@@ -67,6 +318,29 @@ class Gomoku(Game):
                 yield x, y + 1
 
         
+        def _compute_frontier(self):
+            # only allow moves adjacent or diagonal to already placed stones
+            frontier = set()
+            for x in range(self._board_size):
+                for y in range(self._board_size):
+                    if self._board[x][y] != -1:
+                        continue
+                    for n_x, n_y in self.neighbors(x, y):
+                        if self._board[n_x][n_y] != -1:
+                            frontier.add((x, y))
+                            break
+            return frontier
+
+        def _next_frontier(self, action):
+            # the frontier after playing action, found from the eight neighbors of action
+            # instead of rescanning the board
+            frontier = set(self._frontier)
+            frontier.discard(action)
+            for n_x, n_y in self.neighbors(*action):
+                if self._board[n_x][n_y] == -1:
+                    frontier.add((n_x, n_y))
+            return frontier
+
         def is_legal(self, action):
             '''
             Determines if a given move is legal, given an x, y tuple of an action
@@ -74,31 +348,14 @@ class Gomoku(Game):
             x, y = action
             if x < 0 or y < 0 or x >= self._board_size or y >= self._board_size:
                 raise ValueError('Move out of bounds: ', str(action))
-            if self._board[x][y] != -1:
-                return False
-            # only allow moves adjacent or diagonal to already placed stones
-            has_neighbor = False
-            for n_x, n_y in self.neighbors(x, y):
-                # print(action, n_x, n_y)
-                if self._board[n_x][n_y] != -1:
-                    has_neighbor = True
-                    break
-            return has_neighbor
+            return action in self._frontier
 
         
         def get_actions(self):
-            ''' Returns a list of legal moves from this state.
-                The list of moves is given as a list of pits to sow from.
-                Pits are indexed clockwise starting with 0 for player 0's
-                first pit.
+            ''' Returns a list of legal moves from this state in row-major order.
+                The moves are the empty cells adjacent or diagonal to a stone.
             '''
-            moves = []
-            for x in range(self._board_size):
-                for y in range(self._board_size):
-                    tup = (x, y)
-                    if self.is_legal(tup):
-                        moves.append(tup)
-            return moves
+            return sorted(self._frontier)
 
         def make_move(self, action, player):
             x, y = action
@@ -131,13 +388,16 @@ class Gomoku(Game):
             if not self.is_legal(action):
                 raise ValueError('Illegal move: ', str(action))
 
-            succ = Gomoku.State(self._board, 1 - self._turn, self._stones_played + 1)
+            x, y = action
+            cell_keys, turn_key = _zobrist_keys(self._board_size)
+            key = self.key ^ cell_keys[self._turn][x][y] ^ turn_key
+            succ = Gomoku.State(self._board, 1 - self._turn, self._stones_played + 1, self._next_frontier(action), key)
             succ.make_move(action, self._turn)
 
             # if game is over, update winner
             if succ.check_win(action):
                 succ.winner = self._turn
-            elif not succ.get_actions():
+            elif not succ._frontier:
                 succ.winner = 2
 
             return succ
@@ -162,32 +422,215 @@ class Gomoku(Game):
                 return 1 if self.winner == 0 else -1
             
         def __str__(self) -> str:
-            ans = f"{self._turn}, {self._stones_played}\n"
-            for row in self._board:
-                row_str = []
-                for space in row:
-                    if space == -1:
-                        row_str.append("\033[1;30mE")
-                    elif space == 0:
-                        row_str.append("\033[0;34m0")
-                    else:
-                        row_str.append("\033[1;33m1")
-                row_str.append("\033[0m")
-                ans += "".join(row_str) + "\n"
-            return ans
+            return _board_str(self._turn, self._stones_played, self._board)
         
         def board(self):
             return self._board
 
+        def position(self):
+            ''' Returns a mutable Gomoku.Position for searching from this state.
+            '''
+            return Gomoku.Position.from_state(self)
+
         
-        def _compute_hash(self):
-            self.hash = hash(str(self._board)) * 2 + self._turn
-            
         def __hash__(self):
-            return self.hash
+            return self.key
         
         def __eq__(self, other):
-            return isinstance(other, self.__class__) and self._turn == other._turn and self._board == other._board
+            # compare keys first so unequal states almost never look at the boards
+            return isinstance(other, self.__class__) and self.key == other.key and self._turn == other._turn and self._board == other._board
+
+
+    class Position:
+        ''' A mutable position for search.  play and undo change the board, turn, winner, key
+            and set of legal moves in place, so walking a search tree allocates nothing per node.
+            Supports the read-only part of the State interface (actor, get_actions, is_legal,
+            is_terminal, payoff, board), and to_state gives back an immutable state.  key is
+            the same Zobrist key the immutable states use for this position.
+        '''
+        def __init__(self, board, turn, stones_played, winner=None, bitboard=False):
+            if board is None:
+                raise ValueError('board cannot be None')
+            if turn != 0 and turn != 1:
+                raise ValueError('invalid turn %d' % turn)
+
+            self._board_size = len(board)
+            self._board = [list(row) for row in board]
+            self._turn = turn
+            self._stones_played = stones_played
+            self._bitboard = bitboard
+            self.winner = winner
+
+            # moves played so far as (action, winner before the move) for undo
+            self._history = []
+            self._neighbor_cells = _neighbor_table(self._board_size)
+
+            # number of stones adjacent or diagonal to each cell; empty cells with a
+            # nonzero count are the legal moves
+            self._adjacent = [[0] * self._board_size for i in range(self._board_size)]
+            for x in range(self._board_size):
+                for y in range(self._board_size):
+                    if self._board[x][y] != -1:
+                        for n_x, n_y in self._neighbors(x, y):
+                            self._adjacent[n_x][n_y] += 1
+            self._frontier = set()
+            for x in range(self._board_size):
+                for y in range(self._board_size):
+                    if self._board[x][y] == -1 and self._adjacent[x][y] > 0:
+                        self._frontier.add((x, y))
+
+            self._cell_keys, self._turn_key = _zobrist_keys(self._board_size)
+            self.key = _zobrist_key(self._board, turn)
+
+        @classmethod
+        def from_state(cls, state):
+            ''' Creates a Position from a Gomoku.State or Gomoku.BitState.
+            '''
+            board = state.board()
+            stones_played = sum(space != -1 for row in board for space in row)
+            return cls(board, state.actor(), stones_played, state.winner, isinstance(state, Gomoku.BitState))
+
+        def to_state(self):
+            ''' Returns an immutable state equal to this position, of the same class as the
+                state this position was created from.
+            '''
+            if self._bitboard:
+                state = Gomoku.BitState.from_board(self._board, self._turn, self._stones_played)
+            else:
+                state = Gomoku.State(self._board, self._turn, self._stones_played, set(self._frontier), self.key)
+            state.winner = self.winner
+            return state
+
+        def position(self):
+            ''' Returns an independent copy of this position, as the states' position() does, so
+                a search can play and undo moves on it without changing this one.
+            '''
+            return Gomoku.Position(self._board, self._turn, self._stones_played, self.winner, self._bitboard)
+
+        def _neighbors(self, x, y):
+            return self._neighbor_cells[x][y]
+
+        def actor(self):
+            ''' Returns the index of the player who makes the next move from
+                this position.  The index will be 0 or 1.
+            '''
+            return self._turn
+
+        def is_legal(self, action):
+            '''
+            Determines if a given move is legal, given an x, y tuple of an action
+            '''
+            x, y = action
+            if x < 0 or y < 0 or x >= self._board_size or y >= self._board_size:
+                raise ValueError('Move out of bounds: ', str(action))
+            return action in self._frontier
+
+        def get_actions(self):
+            ''' Returns a list of legal moves from this position in row-major order.
+            '''
+            return sorted(self._frontier)
+
+        def check_win(self, last_action):
+            x_start, y_start = last_action
+            player = self._board[x_start][y_start]
+            for x_diff, y_diff in ((1, 1), (1, 0), (0, 1), (1, -1)):
+                total = 1
+                for direction in (-1, 1):
+                    x_curr, y_curr = x_start + x_diff * direction, y_start + y_diff * direction
+                    while 0 <= x_curr < self._board_size and 0 <= y_curr < self._board_size and self._board[x_curr][y_curr] == player:
+                        total += 1
+                        x_curr += x_diff * direction
+                        y_curr += y_diff * direction
+                if total >= 5:
+                    return True
+            return False
+
+        def play(self, action):
+            ''' Plays action for the player to move, updating this position in place.
+            '''
+            if action not in self._frontier:
+                raise ValueError('Illegal move: ', str(action))
+
+            x, y = action
+            player = self._turn
+            self._history.append((action, self.winner))
+            self._board[x][y] = player
+            self._frontier.discard(action)
+            for n_x, n_y in self._neighbors(x, y):
+                self._adjacent[n_x][n_y] += 1
+                if self._board[n_x][n_y] == -1:
+                    self._frontier.add((n_x, n_y))
+            self.key ^= self._cell_keys[player][x][y] ^ self._turn_key
+            self._turn = 1 - player
+            self._stones_played += 1
+
+            # if game is over, update winner
+            if self.check_win(action):
+                self.winner = player
+            elif not self._frontier:
+                self.winner = 2
+
+        def undo(self):
+            ''' Takes back the last move passed to play.
+            '''
+            action, self.winner = self._history.pop()
+            x, y = action
+            self._stones_played -= 1
+            self._turn = 1 - self._turn
+            self.key ^= self._cell_keys[self._turn][x][y] ^ self._turn_key
+            self._board[x][y] = -1
+            for n_x, n_y in self._neighbors(x, y):
+                self._adjacent[n_x][n_y] -= 1
+                if self._adjacent[n_x][n_y] == 0:
+                    self._frontier.discard((n_x, n_y))
+            if self._adjacent[x][y] > 0:
+                self._frontier.add(action)
+
+        def stones_played(self):
+            ''' Returns the number of stones on the board.
+            '''
+            return self._stones_played
+
+        def adjacent_stones(self, action):
+            ''' Returns the number of stones of either player next to action.
+            '''
+            x, y = action
+            return self._adjacent[x][y]
+
+        def successor_key(self, action):
+            ''' Returns the Zobrist key of the position after playing action, without playing it.
+            '''
+            x, y = action
+            return self.key ^ self._cell_keys[self._turn][x][y] ^ self._turn_key
+
+        def last_action(self):
+            ''' Returns the last move played, or None if nothing has been played on this position.
+            '''
+            return self._history[-1][0] if self._history else None
+
+        def is_terminal(self):
+            ''' Determines if this position is terminal -- whether the game is over.
+            '''
+            return self.winner is not None
+
+        def payoff(self):
+            ''' Returns the payoff to player 0 at this position: 1 for a win, 0 for a draw, -1 for
+                a loss.  The return value is None if this position is not terminal.
+            '''
+            if not self.is_terminal():
+                return None
+            elif self.winner == 2:
+                return 0
+            else:
+                return 1 if self.winner == 0 else -1
+
+        def __str__(self) -> str:
+            return _board_str(self._turn, self._stones_played, self._board)
+
+        def board(self):
+            ''' Returns the board as a list of lists.  It changes as moves are played and undone.
+            '''
+            return self._board
 
 
 if __name__ == '__main__':
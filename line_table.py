@@ -0,0 +1,251 @@
+from collections import OrderedDict
+
+# Lookup tables for the line heuristic in minimax.py and minimax_genetic.py.  Every row, column
+# and diagonal that can hold five in a row is encoded as a base 3 integer (digit 0 for an empty
+# cell, 1 for player 0 and 2 for player 1, first cell least significant), and the table maps that
+# code to the terms the heuristic adds for the line.
+
+# Weight of a run of five or more when weight_rows has no entry for it, as with the genetic weight
+# vectors, which only weigh runs of one to four.  A run that long means the game is over, and
+# terminal positions are scored by their payoff instead, but an Evaluator still rescores the
+# lines of a winning move before it is taken back.
+WEIGHT_WIN = 10 ** 10
+
+# Evaluator keeps its total as an integer count of 2 ** -64ths, which holds every term exactly, so
+# the total depends only on the position and not on the order the moves were played in
+EXACT_SCALE = 2 ** 64
+
+def board_lines(board_size):
+    """Returns the lines scored by the heuristic as six groups of lists of (x, y) cells, in the
+    same order and direction as minimax.DIRECTIONS walks them"""
+
+    n = board_size
+    horiz = [[(row, i) for i in range(n)] for row in range(n)]
+    vert = [[(i, col) for i in range(n)] for col in range(n)]
+    diag_down = [[(i, y + i) for i in range(n - y)] for y in range(0, n - 4)]
+    diag_up = [[(i, y - i) for i in range(y + 1)] for y in range(4, n)]
+    diag_left = [[(n - 1 - i, y - i) for i in range(y + 1)] for y in range(4, n - 1)]
+    diag_right = [[(n - 1 - i, y + i) for i in range(n - y)] for y in range(1, n - 4)]
+    return [horiz, vert, diag_down, diag_up, diag_left, diag_right]
+
+
+def line_terms(cells, weight_rows, weight_space):
+    """Returns the terms the heuristic adds for one line of cells (-1 empty, 0/1 for a player's
+    stone), positive for player 0.  The runs are parsed exactly as minimax.evaluate_direction
+    does and the terms are kept in the same order, so adding them one at a time reproduces its
+    total bit for bit."""
+
+    prev = [[-1, 0, 0, 0]]
+    for space in cells:
+        if space == -1:
+            prev[-1][3] += 1
+        elif space == prev[-1][0] and prev[-1][3] == 0:
+            prev[-1][2] += 1
+        else:
+            prev.append([space, prev[-1][3], 1, 0])
+    terms = []
+    for player, blanks_before, count, blanks_after in prev:
+        if player == -1 or blanks_before + count + blanks_after < 5:
+            continue
+        factor = 1 if player == 0 else -1
+        weight = weight_rows[count - 1] if count <= len(weight_rows) else WEIGHT_WIN
+        terms.append(factor * weight * weight_space[blanks_before + count + blanks_after - 5])
+    return tuple(terms)
+
+
+class LineTable:
+    """Heuristic evaluation by table lookup for one weight vector.  Line codes are scored the
+    first time they are seen and remembered, so the table only holds patterns that occur."""
+
+    def __init__(self, weight_rows, weight_space, board_size=11):
+        self.weight_rows = weight_rows
+        self.weight_space = weight_space
+        self.board_size = board_size
+
+        # Flat list of lines and the [start, end) range of each direction group in it
+        self.lines = []
+        self.groups = []
+        for group in board_lines(board_size):
+            self.groups.append((len(self.lines), len(self.lines) + len(group)))
+            self.lines.extend(group)
+        self.lengths = [len(line) for line in self.lines]
+
+        # For each cell, (line index, power of 3) for every line through it
+        self.cell_lines = [[[] for y in range(board_size)] for x in range(board_size)]
+        for index, line in enumerate(self.lines):
+            for position, (x, y) in enumerate(line):
+                self.cell_lines[x][y].append((index, 3 ** position))
+
+        # Terms for each line code, one dict per line length, and the same for their sums in
+        # units of 1 / EXACT_SCALE
+        self.terms = {length: {0: ()} for length in set(self.lengths)}
+        self.exact = {length: {0: 0} for length in set(self.lengths)}
+
+    def line_terms(self, length, code):
+        """Returns the heuristic terms of the line of the given length and code"""
+
+        table = self.terms[length]
+        terms = table.get(code)
+        if terms is None:
+            cells = []
+            rest = code
+            for i in range(length):
+                rest, digit = divmod(rest, 3)
+                cells.append(digit - 1)
+            terms = line_terms(cells, self.weight_rows, self.weight_space)
+            table[code] = terms
+        return terms
+
+    def line_exact(self, length, code):
+        """Returns the sum of the heuristic terms of the line as an integer number of 1 / EXACT_SCALE"""
+
+        table = self.exact[length]
+        exact = table.get(code)
+        if exact is None:
+            # scaling by a power of two is exact, so each term becomes an exact integer
+            exact = sum(round(term * EXACT_SCALE) for term in self.line_terms(length, code))
+            table[code] = exact
+        return exact
+
+    def line_codes(self, board):
+        """Returns the code of every line on a list of lists board"""
+
+        codes = [0] * len(self.lines)
+        cell_lines = self.cell_lines
+        for x, row in enumerate(board):
+            for y, space in enumerate(row):
+                if space != -1:
+                    for index, power in cell_lines[x][y]:
+                        codes[index] += power * (space + 1)
+        return codes
+
+    def total(self, codes):
+        """Returns the heuristic value for player 0 of the lines with the given codes, adding the
+        terms in the same order as minimax.heuristic"""
+
+        total = 0
+        terms = self.terms
+        lengths = self.lengths
+        for start, end in self.groups:
+            group_total = 0
+            for index in range(start, end):
+                code = codes[index]
+                if code:
+                    line = terms[lengths[index]].get(code)
+                    if line is None:
+                        line = self.line_terms(lengths[index], code)
+                    for term in line:
+                        group_total += term
+            total += group_total
+        return total
+
+    def evaluate(self, board):
+        """Returns the heuristic value for player 0 of a nonterminal list of lists board"""
+
+        return self.total(self.line_codes(board))
+
+    def evaluator(self, board):
+        """Returns an Evaluator for a list of lists board"""
+
+        return Evaluator(self, board)
+
+
+class Evaluator:
+    """Heuristic value of a position kept up to date as moves are played and undone.  Holds the
+    code and terms of every line and the exact total of their terms, so a move only rescores the
+    four lines through it.  The value is that total rounded once, so it is the same however the
+    position was reached, and only differs from LineTable.evaluate, which rounds after every term,
+    by that rounding."""
+
+    def __init__(self, table, board):
+        self.table = table
+        self.codes = table.line_codes(board)
+        self.terms = [table.line_terms(length, code) for length, code in zip(table.lengths, self.codes)]
+        self.exact = [table.line_exact(length, code) for length, code in zip(table.lengths, self.codes)]
+        self.total = sum(self.exact)
+
+        # moves pushed so far as (x, y, player) for pop
+        self.history = []
+
+    def add(self, action, player):
+        """Adds a stone for player on action, rescoring the lines through it"""
+
+        x, y = action
+        self.history.append((x, y, player))
+        self._rescore(x, y, player + 1)
+
+    def push(self, action, player):
+        """Adds a stone for player on action and returns the new value"""
+
+        self.add(action, player)
+        return self.value()
+
+    def pop(self):
+        """Takes back the last stone added by add or push"""
+
+        x, y, player = self.history.pop()
+        self._rescore(x, y, -(player + 1))
+
+    def gain(self, action, player):
+        """Returns how much a stone for player on action would change the value for player 0,
+        without adding it.  Only close to the change in value(), since the terms are added in a
+        different order."""
+
+        x, y = action
+        table = self.table
+        codes = self.codes
+        lengths = table.lengths
+        digit = player + 1
+        change = 0
+        for index, power in table.cell_lines[x][y]:
+            terms = table.terms[lengths[index]].get(codes[index] + power * digit)
+            if terms is None:
+                terms = table.line_terms(lengths[index], codes[index] + power * digit)
+            change += sum(terms) - sum(self.terms[index])
+        return change
+
+    def _rescore(self, x, y, digit):
+        """Adds digit to the cell's place in the codes of the lines through it, updating their
+        terms and the total"""
+
+        table = self.table
+        codes = self.codes
+        exact = self.exact
+        lengths = table.lengths
+        for index, power in table.cell_lines[x][y]:
+            code = codes[index] + power * digit
+            codes[index] = code
+            terms = table.terms[lengths[index]].get(code)
+            if terms is None:
+                terms = table.line_terms(lengths[index], code)
+            self.terms[index] = terms
+            line_exact = table.exact[lengths[index]].get(code)
+            if line_exact is None:
+                line_exact = table.line_exact(lengths[index], code)
+            self.total += line_exact - exact[index]
+            exact[index] = line_exact
+
+    def value(self):
+        """Returns the heuristic value for player 0, ignoring whether the position is terminal"""
+
+        # integer true division rounds the exact total once
+        return self.total / EXACT_SCALE
+
+
+# Recently used tables by weight vector, so minimax_genetic can switch weights cheaply
+MAX_CACHED_TABLES = 16
+_tables = OrderedDict()
+
+def get_table(weight_rows, weight_space, board_size=11):
+    """Returns a LineTable for the given weights, reusing one built earlier if possible"""
+
+    key = (tuple(weight_rows), tuple(weight_space), board_size)
+    table = _tables.get(key)
+    if table is None:
+        table = LineTable(weight_rows, weight_space, board_size)
+        _tables[key] = table
+        if len(_tables) > MAX_CACHED_TABLES:
+            _tables.popitem(last=False)
+    else:
+        _tables.move_to_end(key)
+    return table
@@ -0,0 +1,177 @@
+import time
+from math import log
+from random import choice
+from playout import random_playouts
+
+# NumPy is only needed for this tree
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# UCT0 as in mcts_uct0, but with the tree kept as a struct of arrays: one NumPy array per field,
+# indexed by node, with the children of a node in one contiguous block.  Nodes hold no State; the
+# position is rebuilt on one Gomoku.Position by playing the moves on the way down from the root and
+# taking them back afterwards.  A node's children are all scored with one vectorised UCB
+# expression, so selection costs about the same however many children there are.
+
+# Nodes allocated at first, doubled whenever a block of children does not fit
+INITIAL_CAPACITY = 4096
+
+
+class SoATree:
+    """
+    UCT0 tree for one search from root_state.  Node 0 is the root.  Children are allocated as a
+    block when their parent is first expanded, but are added to the search one at a time in
+    get_actions() order as MonteCarloTree.expand does, so expanded[node] counts the children in use.
+    """
+
+    def __init__(self, root_state, time_limit, capacity=INITIAL_CAPACITY):
+        if np is None:
+            raise ImportError("mcts_soa requires numpy")
+        self.pos = root_state.position()
+        self.board_size = len(self.pos.board())
+        self.time_limit = time_limit
+
+        # Fields per node: rollouts and total value for player 0 through it, parent (-1 for the
+        # root), block of children, children added so far, and action as x * board size + y
+        self.visits = np.zeros(capacity, dtype=np.int32)
+        self.values = np.zeros(capacity, dtype=np.float64)
+        self.parent = np.full(capacity, -1, dtype=np.int32)
+        self.first_child = np.zeros(capacity, dtype=np.int32)
+        self.child_count = np.zeros(capacity, dtype=np.int16)
+        self.expanded = np.zeros(capacity, dtype=np.int16)
+        self.action = np.zeros(capacity, dtype=np.int16)
+        self.size = 1
+
+        # Number of rollouts played by find_move
+        self.playouts = 0
+
+    def capacity(self):
+        return len(self.visits)
+
+    def grow(self, needed):
+        """Doubles every field until at least needed nodes fit"""
+
+        capacity = self.capacity()
+        while capacity < needed:
+            capacity *= 2
+        for name in ("visits", "values", "first_child", "child_count", "expanded", "action"):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+        parent = np.full(capacity, -1, dtype=np.int32)
+        parent[:len(self.parent)] = self.parent
+        self.parent = parent
+
+    def allocate_children(self, node):
+        """Allocates the block of children of node, one per legal action of the current position"""
+
+        actions = self.pos.get_actions()
+        first = self.size
+        if first + len(actions) > self.capacity():
+            self.grow(first + len(actions))
+        block = slice(first, first + len(actions))
+        self.action[block] = [x * self.board_size + y for x, y in actions]
+        self.parent[block] = node
+        self.first_child[node] = first
+        self.child_count[node] = len(actions)
+        self.size += len(actions)
+
+    def select(self, node):
+        """Returns the child of a fully expanded node with the best UCB, ties broken at random"""
+
+        first = self.first_child[node]
+        block = slice(first, first + self.child_count[node])
+        visits = self.visits[block]
+        # Player 0 maximizes value + explore, player 1 minimizes value - explore
+        sign = 1.0 if self.pos.actor() == 0 else -1.0
+        ucb = sign * self.values[block] / visits + np.sqrt(2 * log(self.visits[node]) / visits)
+        best = np.flatnonzero(ucb == ucb.max())
+        return first + int(choice(best))
+
+    def play(self, node):
+        self.pos.play(divmod(int(self.action[node]), self.board_size))
+
+    def get_leaf(self):
+        """Walks down from the root while nodes are fully expanded, playing their moves on the
+        position.  Returns the leaf and the number of moves played."""
+
+        node = 0
+        depth = 0
+        while not self.pos.is_terminal():
+            if self.child_count[node] == 0:
+                self.allocate_children(node)
+            if self.expanded[node] < self.child_count[node]:
+                break
+            node = self.select(node)
+            self.play(node)
+            depth += 1
+        return node, depth
+
+    def expand(self, node):
+        """Adds the next child of node to the search and plays its move.  Returns the child."""
+
+        child = self.first_child[node] + self.expanded[node]
+        self.expanded[node] += 1
+        self.play(child)
+        return child
+
+    def backpropagate(self, node, value):
+        """Adds a rollout's value to node and every node above it"""
+
+        path = []
+        while node >= 0:
+            path.append(node)
+            node = self.parent[node]
+        self.visits[path] += 1
+        self.values[path] += value
+
+    def get_best_move(self):
+        """Returns the root action with the best average for the player to move, ties broken at random"""
+
+        first = self.first_child[0]
+        block = slice(first, first + self.expanded[0])
+        sign = 1.0 if self.pos.actor() == 0 else -1.0
+        avg = sign * self.values[block] / self.visits[block]
+        best = first + int(choice(np.flatnonzero(avg == avg.max())))
+        return divmod(int(self.action[best]), self.board_size)
+
+    def find_move(self):
+        """Function that returns the best move from the MCTS"""
+
+        end_time = time.time() + self.time_limit
+        while time.time() < end_time:
+            node, depth = self.get_leaf()
+            if not self.pos.is_terminal():
+                node = self.expand(node)
+                depth += 1
+            value = random_playouts(self.pos)[0]
+            self.backpropagate(node, value)
+            self.playouts += 1
+            for i in range(depth):
+                self.pos.undo()
+        return self.get_best_move()
+
+    def nodes(self):
+        """Returns the number of nodes added to the search: the root and the children in use"""
+
+        return int(self.expanded[:self.size].sum()) + 1
+
+    def node_bytes(self):
+        """Returns the bytes allocated for the arrays, including the unused rest of each block of
+        children and the spare capacity, per node added to the search"""
+
+        fields = (self.visits, self.values, self.parent, self.first_child, self.child_count, self.expanded, self.action)
+        return sum(field.nbytes for field in fields) / self.nodes()
+
+
+def mcts_policy(time_limit):
+    """
+    Returns a function that takes a position and returns the move suggested by running UCT0 on a
+    struct of arrays tree for that amount of time starting with that position
+    """
+    def policy(position):
+        return SoATree(position, time_limit).find_move()
+    return policy
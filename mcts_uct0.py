@@ -1,9 +1,26 @@
+import os
 import time
-from math import log, sqrt
+import random
+from math import log, sqrt, ceil
 from random import choice
+from playout import random_playouts
+from rollout_pool import get_executor
+import line_table
+import minimax
+
+# Progressive widening -> a node visited n times may have ceil(WIDENING_SCALE * n ** WIDENING_EXPONENT)
+# children, added best first by the minimax heuristic's line scores
+WIDENING_SCALE = 2
+WIDENING_EXPONENT = 0.5
+
+# Weight of the heuristic prior in UCB, which fades as 1 / (visits + 1)
+PRIOR_WEIGHT = 1.0
 
 class Node:
     """Class for each node in the monte carlo tree"""
+
+    # Fixed attributes, so nodes carry no per-instance dict
+    __slots__ = ("state", "value", "visits", "children", "parent", "player", "isFullyExpanded", "_actions", "priors")
     
     def __init__(self, state, parent = None):
         """Contains variables for explicit tree"""
@@ -31,6 +48,9 @@ class Node:
         # If the node is not terminal, get and cache the actions
         if not self.isFullyExpanded:
             self._actions = self.state.get_actions()
+
+        # Heuristic prior per action for progressive widening -> set when actions are ranked
+        self.priors = None
     
     @property
     def actions(self):
@@ -46,15 +66,63 @@ class Node:
         """For debugging purposes"""
 
         return str(self.visits) + " | " +str(self.value) + " | " + str(self.isFullyExpanded)
+
+class MoveNode:
+    """
+    Node that stores only the move leading to it instead of a state -> positions are rebuilt by
+    playing the moves from the root on one Gomoku.Position (see MoveTree)
+    """
+
+    __slots__ = ("action", "value", "visits", "children", "parent", "player", "isFullyExpanded", "_actions", "priors")
+
+    def __init__(self, pos, action=None, parent=None):
+        """pos -> the position at this node, only read while the node is created"""
+
+        # Fundamentals
+        self.action = action
+        self.value = 0
+        self.visits = 0
+
+        # Maps action to next node
+        self.children = {}
+
+        # For backpropogating
+        self.parent = parent
+
+        # For calculating UCB
+        self.player = pos.actor()
+
+        # For getting leaf from UCB -> isFullyExpanded means all children in children
+        self.isFullyExpanded = pos.is_terminal()
+
+        # Actions still to be expanded -> fetched on first expansion and dropped once all are children
+        self._actions = None
+
+        # Heuristic prior per action for progressive widening -> set when actions are ranked
+        self.priors = None
+
+    def calculate_avg(self):
+        """For choosing the best action at the end"""
+
+        return self.value / self.visits
+
+    def __str__(self):
+        """For debugging purposes"""
+
+        return str(self.action) + " | " + str(self.visits) + " | " + str(self.value) + " | " + str(self.isFullyExpanded)
     
 class MonteCarloTree:
     """Class for explicit Monte Carlo Tree -> benefits = faster performance so more iterations"""
 
-    def __init__(self, root, time_limit):
-        """Initialize root of tree and time limit given as parameters"""
+    def __init__(self, root, time_limit, widening=False):
+        """Initialize root of tree and time limit given as parameters
+        widening -> add children best first by heuristic, more as a node's visits grow, with the heuristic as a UCB prior"""
         self.root = root
         self.time_limit = time_limit
+        self.widening = widening
 
+        # Number of rollouts played by find_move
+        self.playouts = 0
 
     def calculate_action(self, node):
         """
@@ -71,9 +139,11 @@ class MonteCarloTree:
         curr_best_ucb = float('-inf') if node.player == 0 else float('inf')
         
         # Traverse children values that have been seen
-        for next_state in node.children.values():
+        for action, next_state in node.children.items():
             if node.player == 0:
                 ucb_val = (next_state.value / next_state.visits) + sqrt((2 * log(node.visits)) / next_state.visits)
+                if node.priors is not None:
+                    ucb_val += self.prior_bonus(node, action, next_state)
             
                 # Maximize
                 if ucb_val == curr_best_ucb:
@@ -83,6 +153,8 @@ class MonteCarloTree:
                     curr_best_ucb = ucb_val
             else:
                 ucb_val = (next_state.value / next_state.visits) - sqrt((2 * log(node.visits)) / next_state.visits)
+                if node.priors is not None:
+                    ucb_val -= self.prior_bonus(node, action, next_state)
             
                 # Minimize
                 if ucb_val == curr_best_ucb:
@@ -94,11 +166,46 @@ class MonteCarloTree:
         # Return random state from best states
         return choice(curr_best_state)
     
+    def prior_bonus(self, node, action, child):
+        """UCB bias from the heuristic prior of action, fading as the child is visited"""
+
+        return PRIOR_WEIGHT * node.priors[action] / (child.visits + 1)
+
+    def rank_actions(self, pos, actions):
+        """
+        Returns actions sorted best first by the minimax heuristic's line scores for the player to
+        move in pos, and a dict of each action's prior from 0 to 1
+        A move scores what it gains for the player to move plus what it would gain the opponent,
+        so both threats and blocks come first
+        """
+
+        board = pos.board()
+        evaluator = line_table.get_table(minimax.WEIGHT_ROWS, minimax.WEIGHT_SPACE, len(board)).evaluator(board)
+
+        # Gain for player 0 of a stone of player 0, less that of a stone of player 1 -> the same for either player to move
+        scores = {action: evaluator.gain(action, 0) - evaluator.gain(action, 1) for action in actions}
+
+        # Sorted is stable so equal scores stay in row-major order
+        ranked = sorted(actions, key=lambda action: scores[action], reverse=True)
+        top = scores[ranked[0]] if ranked else 0
+        priors = {action: max(scores[action], 0) / top if top > 0 else 0 for action in actions}
+        return ranked, priors
+
+    def can_add_child(self, node):
+        """Whether node may get another child -> with widening, only as many as its visits allow"""
+
+        if node.isFullyExpanded:
+            return False
+        if not self.widening:
+            return True
+        allowed = max(1, ceil(WIDENING_SCALE * node.visits ** WIDENING_EXPONENT))
+        return len(node.children) < allowed
+
     def get_leaf(self, node):
         """Gets a leaf to either rollout and expand from"""
 
-        # Keep searching until you either hit a terminal or a node that hasn't been fully expanded
-        while not node.state.is_terminal() and node.isFullyExpanded:
+        # Keep searching until you either hit a terminal or a node that can get another child
+        while not node.state.is_terminal() and not self.can_add_child(node):
             # Calculate UCB and get best UCB
             next_node = self.calculate_action(node)
 
@@ -113,7 +220,9 @@ class MonteCarloTree:
         Used for expanding out the chosen leaf node from the UCB selection
         """
 
-        # Get all available actions
+        # Get all available actions -> ranked by heuristic the first time with widening
+        if self.widening and node.priors is None:
+            node._actions, node.priors = self.rank_actions(node.state, node._actions)
         legal_actions = node.actions
 
         # Get action that hasn't been seen before -> len of children already seen optimization
@@ -134,16 +243,8 @@ class MonteCarloTree:
         Used for rolling out to find a terminal value -> later to be propagated upwards
         """
 
-        # Keep searching until you hit a terminal
-        while True:
-            # Found terminal so return payoff value
-            if pos.is_terminal():
-                return pos.payoff()
-            
-            # Choose random action from available action until terminal
-            available_actions = pos.get_actions()
-            action = choice(available_actions)
-            pos = pos.successor(action)
+        # Play random actions until terminal on the playout engine's flat board
+        return random_playouts(pos)[0]
     
     def backpropagate(self, node, val):
         """
@@ -211,23 +312,208 @@ class MonteCarloTree:
             
             # Update: Propagate back up to the root and update values and visits
             self.backpropagate(current, value)
+            self.playouts += 1
         
         # After time is up, find move that gets best average
         return self.get_best_move()
 
-def mcts_policy(time_limit):
+    def root_statistics(self):
+        """Returns a dict from each action searched at the root to its child's (visits, total value)"""
+
+        return {action: (child.visits, child.value) for action, child in self.root.children.items()}
+
+
+class MoveTree(MonteCarloTree):
+    """
+    Monte Carlo Tree of MoveNodes -> the tree holds one mutable position, which is walked down from
+    the root by playing each node's move and taken back after the rollout
+    """
+
+    def __init__(self, root, time_limit, position, widening=False):
+        """root -> MoveNode for position, the Gomoku.State or Gomoku.Position to search from
+        The moves are played on a copy, so position itself is never changed"""
+        super().__init__(root, time_limit, widening)
+        self.pos = position.position()
+
+    def get_leaf(self, node):
+        """Gets a leaf to either rollout and expand from, playing the moves on the way down"""
+
+        while not self.pos.is_terminal() and not self.can_add_child(node):
+            node = self.calculate_action(node)
+            self.pos.play(node.action)
+        return node
+
+    def expand(self, node):
+        """
+        Used for expanding out the chosen leaf node from the UCB selection, playing its move
+        """
+
+        # Get all available actions the first time the node is expanded
+        if node._actions is None:
+            node._actions = self.pos.get_actions()
+            if self.widening:
+                node._actions, node.priors = self.rank_actions(self.pos, node._actions)
+        legal_actions = node._actions
+
+        # Inserts one child at a time as MonteCarloTree.expand does
+        index = len(node.children)
+        action = legal_actions[index]
+        self.pos.play(action)
+        child = MoveNode(self.pos, action, parent=node)
+        node.children[action] = child
+
+        # If searched all children then isFullyExpanded is true, and the actions are not needed anymore
+        if len(node.children) == len(legal_actions):
+            node.isFullyExpanded = True
+            node._actions = None
+
+        # Return nonsearched child
+        return child
+
+    def find_move(self):
+        """Function that returns the best move from the MCTS"""
+
+        # Calculate end time
+        end_time = time.time() + self.time_limit
+
+        # Traverse until that time is up
+        while time.time() < end_time:
+            # Traverse: Find leaf node, with the position at the leaf
+            depth = self.pos.stones_played()
+            current = self.get_leaf(self.root)
+
+            # Expand: Only if leaf is not terminal
+            if not self.pos.is_terminal():
+                current = self.expand(current)
+
+            # Rollout/simulate: Play from leaf node
+            value = self.rollout(self.pos)
+
+            # Update: Propagate back up to the root and update values and visits
+            self.backpropagate(current, value)
+            self.playouts += 1
+
+            # Take the moves back to return to the root
+            for i in range(self.pos.stones_played() - depth):
+                self.pos.undo()
+
+        # After time is up, find move that gets best average
+        return self.get_best_move()
+
+    def find_subtree(self, position):
+        """
+        Returns the node for position among the root's children and grandchildren, detached as
+        find_subtree does, or None -> the moves are played on this tree's position to compare keys
+        """
+
+        candidates = [((action,), child) for action, child in self.root.children.items()]
+        for action, child in self.root.children.items():
+            candidates.extend(((action, reply), grandchild) for reply, grandchild in child.children.items())
+
+        for moves, node in candidates:
+            for move in moves:
+                self.pos.play(move)
+            found = self.pos.key == position.key
+            for move in moves:
+                self.pos.undo()
+            if found:
+                node.parent = None
+                return node
+        return None
+
+
+def search_tree(position, time_limit):
+    """Grows one tree from position for time_limit seconds in a worker process.
+    Returns its root statistics and the number of rollouts it played."""
+
+    # Forked workers start with the same random state, so each search draws its own seed
+    random.seed(os.urandom(16))
+    mcts_obj = MonteCarloTree(Node(position), time_limit)
+    mcts_obj.find_move()
+    return mcts_obj.root_statistics(), mcts_obj.playouts
+
+def root_parallel_search(position, time_limit, workers):
+    """
+    Grows one independent tree per worker process from position for time_limit seconds, adds up
+    the visits and values of each root action over all the trees, and returns the action with the
+    best average (as get_best_move does for one tree) and the total number of rollouts played
+    """
+
+    futures = [get_executor(workers).submit(search_tree, position, time_limit) for i in range(workers)]
+    visits = {}
+    values = {}
+    playouts = 0
+    for future in futures:
+        statistics, count = future.result()
+        playouts += count
+        for action, (action_visits, action_value) in statistics.items():
+            visits[action] = visits.get(action, 0) + action_visits
+            values[action] = values.get(action, 0) + action_value
+
+    # Player 0 = maximize, player 1 = minimize; ties are broken at random
+    factor = 1 if position.actor() == 0 else -1
+    best_avg = max(factor * values[action] / visits[action] for action in visits)
+    best_moves = [action for action in visits if factor * values[action] / visits[action] == best_avg]
+    return choice(best_moves), playouts
+
+def find_subtree(root, position):
+    """
+    Returns the node for position among the children and grandchildren of root (the move played
+    from root and the reply to it), detached from the rest of the tree so that it can become the
+    new root, or None if that position was never reached
+    """
+
+    # Children first, in case the same policy moved for both players
+    candidates = list(root.children.values())
+    for child in root.children.values():
+        candidates.extend(child.children.values())
+
+    for node in candidates:
+        if node.state.key == position.key:
+            # Cut the parent link so backpropagation stops here and the old tree can be freed
+            node.parent = None
+            return node
+    return None
+
+def mcts_policy(time_limit, workers=1, reuse=True, report=False, state_free=False, widening=False):
     """
     Returns a function that takes a position and returns the move suggested by running MCTS for 
     # that amount of time starting with that position.
+    With more than one worker, each worker process grows its own tree and their root statistics are merged.
+    reuse -> keep the tree between moves, starting from the node for the new position if the last search reached it
+    report -> print the visits inherited from the last search and the rollouts played for each move
+    state_free -> use MoveNodes, which store only their move, instead of a state per node
+    widening -> progressive widening with heuristic priors (see MonteCarloTree)
     """
+
+    # The last search's tree, kept between calls for reuse
+    last_tree = None
+
     def policy(position):
         """Returned function"""
+        nonlocal last_tree
+
+        if workers > 1:
+            return root_parallel_search(position, time_limit, workers)[0]
+
+        # Start from the part of the last tree under the new position, or from a new root
+        root = None
+        if reuse and last_tree is not None:
+            root = last_tree.find_subtree(position) if state_free else find_subtree(last_tree.root, position)
+        if root is None:
+            root = MoveNode(position) if state_free else Node(position)
+        inherited = root.visits
 
         # First create Monte Carlo Tree with the root node
-        mcts_obj = MonteCarloTree(Node(position), time_limit)
+        mcts_obj = MoveTree(root, time_limit, position, widening) if state_free else MonteCarloTree(root, time_limit, widening)
 
         # Return the best move form the MCTS
-        return mcts_obj.find_move()
+        move = mcts_obj.find_move()
+        if reuse:
+            last_tree = mcts_obj
+        if report:
+            print(f"uct0: {move} with {inherited} visits inherited and {mcts_obj.playouts} rollouts played")
+        return move
     
     # Return the policy function
     return policy
\ No newline at end of file
@@ -1,13 +1,26 @@
 import time
-import collections
-import concurrent.futures
 from math import log, sqrt
 from random import choice
+from playout import lockstep_playouts
+from rollout_pool import get_pool, ROLLOUTS_PER_LEAF, WORKERS
+from mcts_uct0 import find_subtree
+
+# RAVE equivalence parameter -> the number of visits at which a child's own average and its AMAF
+# average get equal weight in selection
+RAVE_EQUIVALENCE = 1000
+
+def rave_beta(visits, amaf_visits):
+    """Weight of the AMAF average against a child's own average -> goes from 1 with no visits of
+    the child towards 0 as its visits grow past RAVE_EQUIVALENCE"""
+
+    if amaf_visits == 0:
+        return 0
+    return amaf_visits / (visits + amaf_visits + visits * amaf_visits / RAVE_EQUIVALENCE)
 
 class Node:
     """Class for each node in the monte carlo tree"""
     
-    def __init__(self, state, parent = None):
+    def __init__(self, state, parent = None, action = None):
         """Contains variables for explicit tree"""
 
         # Fundamentals
@@ -15,6 +28,13 @@ class Node:
         self.value = 0
         self.visits = 0
 
+        # Action leading to this node, for AMAF updates along the path
+        self.action = action
+
+        # RAVE -> maps each action of the player to move here to [total value, visits] over the
+        # simulations through this node that played it later on (all moves as first)
+        self.amaf = {}
+
         # Maps action to next state
         self.children = {}
 
@@ -52,18 +72,26 @@ class Node:
 class MonteCarloTree:
     """Class for explicit Monte Carlo Tree -> benefits = faster performance so more iterations"""
 
-    def __init__(self, root, time_limit):
-        """Initialize root of tree and time limit given as parameters"""
+    def __init__(self, root, time_limit, lockstep=None, rollouts=ROLLOUTS_PER_LEAF, workers=WORKERS):
+        """Initialize root of tree and time limit given as parameters
+        lockstep -> if given, number of rollouts per leaf played at once with NumPy instead of on the rollout pool
+        rollouts -> number of rollouts per leaf played on the pool of worker processes
+        workers -> number of worker processes in the rollout pool"""
         self.root = root
         self.time_limit = time_limit
-        self.amaf = collections.defaultdict(set)
+        self.lockstep = lockstep
+        self.rollouts = rollouts
+        self.workers = workers
 
+        # Number of rollouts played by find_move
+        self.playouts = 0
 
     def calculate_action(self, node):
         """
         Gets the most promising action from the UCB 
         Player 0 -> Maximize and + for UCB calculation
         Player 1 -> Minimize and - for UCB calculation
+        The exploit term blends each child's average with the node's AMAF average for its action
         Assumptions: children already in tree -> always true because we only add children to node when it is in tree
         """
 
@@ -74,9 +102,10 @@ class MonteCarloTree:
         curr_best_ucb = float('-inf') if node.player == 0 else float('inf')
         
         # Traverse children values that have been seen
-        for next_state in node.children.values():
+        for action, next_state in node.children.items():
+            exploit = self.blended_avg(node, action, next_state)
             if node.player == 0:
-                ucb_val = (next_state.value / next_state.visits) + sqrt((2 * log(node.visits)) / next_state.visits)
+                ucb_val = exploit + sqrt((2 * log(node.visits)) / next_state.visits)
             
                 # Maximize
                 if ucb_val == curr_best_ucb:
@@ -85,7 +114,7 @@ class MonteCarloTree:
                     curr_best_state = [next_state]
                     curr_best_ucb = ucb_val
             else:
-                ucb_val = (next_state.value / next_state.visits) - sqrt((2 * log(node.visits)) / next_state.visits)
+                ucb_val = exploit - sqrt((2 * log(node.visits)) / next_state.visits)
             
                 # Minimize
                 if ucb_val == curr_best_ucb:
@@ -97,6 +126,16 @@ class MonteCarloTree:
         # Return random state from best states
         return choice(curr_best_state)
     
+    def blended_avg(self, node, action, child):
+        """Average value of child blended with node's AMAF average for action"""
+
+        avg = child.value / child.visits
+        amaf_value, amaf_visits = node.amaf.get(action, (0, 0))
+        if amaf_visits:
+            beta = rave_beta(child.visits, amaf_visits)
+            avg = (1 - beta) * avg + beta * amaf_value / amaf_visits
+        return avg
+    
     def get_leaf(self, node):
         """Gets a leaf to either rollout and expand from"""
 
@@ -122,9 +161,8 @@ class MonteCarloTree:
         # Get action that hasn't been seen before -> len of children already seen optimization
         # Inserts one child at a time rather than all at once because shows performance benefits for low time games
         index = len(node.children)
-        child = Node(node.state.successor(legal_actions[index]), parent=node)
+        child = Node(node.state.successor(legal_actions[index]), parent=node, action=legal_actions[index])
         node.children[legal_actions[index]] = child
-        self.amaf[legal_actions[index]].add(child)
 
         # If searched all children then isFullyExpanded is true
         if len(node.children) == len(legal_actions):
@@ -135,26 +173,42 @@ class MonteCarloTree:
 
     def rollout(self, pos):
         """
-        Used for rolling out to find a terminal value -> later to be propagated upwards
+        Used for rolling out to find terminal values -> later to be propagated upwards
+        Returns (payoffs, move lists) for the rollouts
         """
-        # Maintain a list of actions for AMAF
-        amaf_actions = []
-
-        # Keep searching until you hit a terminal
-        while True:
-            # Found terminal so return payoff value
-            if pos.is_terminal():
-                return pos.payoff(), amaf_actions
-            
-            # Choose random action from available action until terminal
-            available_actions = pos.get_actions()
-            action = choice(available_actions)
+        if pos.is_terminal():
+            return [pos.payoff()] * self.rollouts, [[] for i in range(self.rollouts)]
 
-            # Check if action in tree, if so then add
-            if action in self.amaf:
-                amaf_actions.append(action)
+        # Play random actions until terminal on the persistent pool of worker processes
+        return get_pool(self.workers).playouts(pos, self.rollouts)
 
-            pos = pos.successor(action)
+    def update_amaf(self, leaf, payoffs, move_lists):
+        """
+        Adds each rollout to the AMAF statistics of the nodes on the path from the root to leaf ->
+        a node counts every action its player to move played later in the simulation
+        """
+
+        # Moves from the root down to the leaf
+        path = []
+        node = leaf
+        while node.parent:
+            path.append(node)
+            node = node.parent
+        path.append(node)
+        path.reverse()
+        tree_moves = [node.action for node in path[1:]]
+
+        for depth, node in enumerate(path):
+            amaf = node.amaf
+            for value, moves in zip(payoffs, move_lists):
+                # The moves of this node's player are every other move of the simulation from here
+                for action in (tree_moves[depth:] + moves)[::2]:
+                    stats = amaf.get(action)
+                    if stats is None:
+                        amaf[action] = [value, 1]
+                    else:
+                        stats[0] += value
+                        stats[1] += 1
     
     def backpropagate(self, node, val, rollouts):
         """
@@ -171,7 +225,7 @@ class MonteCarloTree:
 
     def get_best_move(self):
         """
-        Gets the most promising action from the average after time limit
+        Gets the most promising action from the average after time limit, blended with AMAF as in selection
         Player 0 -> Maximize
         Player 1 -> Minimize
         """
@@ -185,7 +239,7 @@ class MonteCarloTree:
         # Traverse children that have been traversed -> none will have visit of 0 from our algorithm
         for action, next_state in self.root.children.items():
             # Calculate average
-            avg_val = next_state.calculate_avg()
+            avg_val = self.blended_avg(self.root, action, next_state)
 
             # If equals, add to best moves list
             if avg_val == curr_best_avg:
@@ -217,42 +271,59 @@ class MonteCarloTree:
             if not current.state.is_terminal():
                 current = self.expand(current)
 
-            # Perform 4 parallel rollouts
-            with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-                futures = [executor.submit(self.rollout, current.state) for _ in range(4)]
-
-                # Wait for all rollouts to complete and collect the results
-                results = [future.result() for future in concurrent.futures.as_completed(futures)]
-
-            # Update AMAF nodes
-            total_value = 0
-            for value, amaf_actions in results:
-                total_value += value
-                for action in amaf_actions:
-                    for node in self.amaf[action]:
-                        node.value += value
-                        node.visits += 1
+            if self.lockstep:
+                # Perform lockstep rollouts as rows of one NumPy array, each counted as a visit
+                payoffs, move_lists = lockstep_playouts(current.state, self.lockstep, record_moves=True)
+                rollouts = self.lockstep
+            else:
+                # Perform the rollouts in parallel on the worker processes, each counted as a visit
+                payoffs, move_lists = self.rollout(current.state)
+                rollouts = self.rollouts
+
+            # Update AMAF statistics of the nodes on the selected path only
+            self.update_amaf(current, payoffs, move_lists)
             
             # Update: Propagate back up to the root and update values and visits
-            self.backpropagate(current, total_value, rollouts=1)
+            self.backpropagate(current, sum(payoffs), rollouts=rollouts)
+            self.playouts += rollouts
         
         # After time is up, find move that gets best average
         return self.get_best_move()
 
-def mcts_policy(time_limit):
+def mcts_policy(time_limit, lockstep=None, rollouts=ROLLOUTS_PER_LEAF, workers=WORKERS, reuse=True, report=False):
     """
     Returns a function that takes a position and returns the move suggested by running MCTS for 
-    # that amount of time starting with that position -> enhanced bt AMAF and leaf parallelism
+    # that amount of time starting with that position -> enhanced bt RAVE and leaf parallelism
+    # lockstep -> number of NumPy lockstep rollouts per leaf, or None for rollouts on the rollout pool
+    # rollouts, workers -> rollouts per leaf and worker processes for the rollout pool, which is
+    # started once and kept for every later move
+    # reuse -> keep the tree between moves, starting from the node for the new position if the last search reached it
+    # report -> print the visits inherited from the last search and the rollouts played for each move
     """
 
+    # Root of the last search's tree, kept between calls for reuse
+    last_root = None
+
     def policy(position):
         """Returned function"""
+        nonlocal last_root
+
+        # Start from the part of the last tree under the new position, or from a new root
+        root = find_subtree(last_root, position) if reuse and last_root is not None else None
+        if root is None:
+            root = Node(position)
+        inherited = root.visits
 
         # First create Monte Carlo Tree with the root node
-        mcts_obj = MonteCarloTree(Node(position), time_limit)
+        mcts_obj = MonteCarloTree(root, time_limit, lockstep, rollouts, workers)
 
         # Return the best move form the MCTS
-        return mcts_obj.find_move()
+        move = mcts_obj.find_move()
+        if reuse:
+            last_root = mcts_obj.root
+        if report:
+            print(f"uct0_enhanced: {move} with {inherited} visits inherited and {mcts_obj.playouts} rollouts played")
+        return move
     
     # Return the policy function
     return policy
\ No newline at end of file
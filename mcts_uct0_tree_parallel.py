@@ -0,0 +1,254 @@
+import os
+import time
+import random
+import multiprocessing
+import queue
+from math import log, sqrt
+from multiprocessing import shared_memory
+from playout import random_playouts
+
+# Tree parallel UCT0: several worker processes grow one tree kept in shared memory.  Each node is a
+# row of a table of fixed width fields, with a node's children in a contiguous block of rows, so
+# workers only share numbers and no Python objects.  A worker walking down the tree adds a virtual
+# loss to every node on its path until it backs up its rollout, so the other workers see that path
+# as worse for a while and spread out over the tree instead of all following the same line.
+
+# Greatest number of nodes in the table; once it is full the tree stops growing
+MAX_NODES = 200000
+
+# Losses counted against a node for each worker currently passing through it
+VIRTUAL_LOSS = 1
+
+# Number of locks guarding the nodes, shared by node index so that workers rarely wait on each other
+LOCK_STRIPES = 64
+
+# Seconds past the time limit to wait for the workers' results before giving up on them
+RESULT_GRACE = 5.0
+
+# Seconds between checks that workers which have not reported are still running
+RESULT_POLL = 0.1
+
+# Node states
+UNEXPANDED = 0
+EXPANDING = 1
+EXPANDED = 2
+
+# Integer fields of a node: rollouts backed up through it, workers on their way through it, its
+# block of children, its action as x * board size + y, and its state.  The header holds the number
+# of nodes in use.
+VISITS, WORKERS, FIRST_CHILD, CHILD_COUNT, ACTION, STATUS = range(6)
+FIELDS = 6
+
+
+class SharedTree:
+    """Node table in a block of shared memory: FIELDS int64 fields per node, followed by one
+    double per node for the total value of the rollouts through it for player 0"""
+
+    def __init__(self, max_nodes=MAX_NODES, name=None):
+        size = 8 + max_nodes * FIELDS * 8 + max_nodes * 8
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self.max_nodes = max_nodes
+        self.header = self.shm.buf[:8].cast('q')
+        self.ints = self.shm.buf[8:8 + max_nodes * FIELDS * 8].cast('q')
+        self.values = self.shm.buf[8 + max_nodes * FIELDS * 8:size].cast('d')
+
+    def close(self):
+        # the views have to be released before the memory can be closed
+        self.header.release()
+        self.ints.release()
+        self.values.release()
+        self.shm.close()
+
+
+def worker(tree_name, max_nodes, root_state, end_time, locks, alloc_lock, virtual_loss, results):
+    """Runs selection, expansion, rollout and backup on the shared tree until end_time, then puts
+    (rollouts played, collisions) on results.  A collision is stepping into a node another
+    worker is still passing through."""
+
+    random.seed(os.urandom(16))
+    tree = SharedTree(max_nodes, tree_name)
+    ints = tree.ints
+    values = tree.values
+    header = tree.header
+    stripes = len(locks)
+    pos = root_state.position()
+    root_player = pos.actor()
+    playouts = 0
+    collisions = 0
+
+    while time.time() < end_time:
+        # Selection: follow UCB from the root, adding virtual loss along the way
+        node = 0
+        path = [0]
+        player = root_player
+        while ints[node * FIELDS + STATUS] == EXPANDED and not pos.is_terminal():
+            base = node * FIELDS
+            first = ints[base + FIRST_CHILD]
+            log_visits = log(max(ints[base + VISITS] + virtual_loss * ints[base + WORKERS], 1))
+            best = []
+            best_ucb = None
+            for child in range(first, first + ints[base + CHILD_COUNT]):
+                child_base = child * FIELDS
+                loss = virtual_loss * ints[child_base + WORKERS]
+                visits = ints[child_base + VISITS] + loss
+                if visits == 0:
+                    ucb = float('inf')
+                else:
+                    # virtual losses count as losses for the player choosing here
+                    value = values[child] - loss if player == 0 else -values[child] - loss
+                    ucb = value / visits + sqrt(2 * log_visits / visits)
+                if best_ucb is None or ucb > best_ucb:
+                    best = [child]
+                    best_ucb = ucb
+                elif ucb == best_ucb:
+                    best.append(child)
+            node = random.choice(best)
+            with locks[node % stripes]:
+                if ints[node * FIELDS + WORKERS] > 0:
+                    collisions += 1
+                ints[node * FIELDS + WORKERS] += 1
+            action = ints[node * FIELDS + ACTION]
+            pos.play(divmod(action, len(pos.board())))
+            path.append(node)
+            player = 1 - player
+
+        # Expansion: add all children of a leaf that has been visited before, one worker at a time
+        base = node * FIELDS
+        if not pos.is_terminal() and (node == 0 or ints[base + VISITS] > 0):
+            expanded = False
+            with locks[node % stripes]:
+                if ints[base + STATUS] == UNEXPANDED:
+                    ints[base + STATUS] = EXPANDING
+                    expanded = True
+            if expanded:
+                actions = pos.get_actions()
+                with alloc_lock:
+                    first = header[0]
+                    if first + len(actions) <= max_nodes:
+                        header[0] = first + len(actions)
+                    else:
+                        first = None
+                if first is None:
+                    # the table is full, so this node stays a leaf
+                    ints[base + STATUS] = UNEXPANDED
+                else:
+                    size = len(pos.board())
+                    for i, (x, y) in enumerate(actions):
+                        child_base = (first + i) * FIELDS
+                        ints[child_base + VISITS] = 0
+                        ints[child_base + WORKERS] = 0
+                        ints[child_base + CHILD_COUNT] = 0
+                        ints[child_base + ACTION] = x * size + y
+                        ints[child_base + STATUS] = UNEXPANDED
+                        values[first + i] = 0.0
+                    ints[base + FIRST_CHILD] = first
+                    ints[base + CHILD_COUNT] = len(actions)
+                    ints[base + STATUS] = EXPANDED
+
+        # Rollout from the leaf
+        value = random_playouts(pos)[0]
+        playouts += 1
+
+        # Backup, taking back the virtual losses
+        for i, node in enumerate(path):
+            with locks[node % stripes]:
+                ints[node * FIELDS + VISITS] += 1
+                if i > 0:
+                    ints[node * FIELDS + WORKERS] -= 1
+                values[node] += value
+        for i in range(len(path) - 1):
+            pos.undo()
+
+    tree.close()
+    results.put((playouts, collisions))
+
+
+def collect_results(results, processes, deadline):
+    """Returns the (rollouts, collisions) the workers put on results.  Stops waiting once every
+    worker has exited, so one that died without reporting (an exception or being killed) is
+    skipped, and terminates any still running at deadline."""
+
+    counts = []
+    while len(counts) < len(processes):
+        try:
+            counts.append(results.get(timeout=RESULT_POLL))
+        except queue.Empty:
+            if not any(process.is_alive() for process in processes):
+                # a worker that exited after reporting has flushed its result, so it is on the queue
+                try:
+                    while len(counts) < len(processes):
+                        counts.append(results.get(timeout=RESULT_POLL))
+                except queue.Empty:
+                    pass
+                break
+            if time.time() > deadline:
+                break
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+        process.join()
+    return counts
+
+
+def tree_parallel_search(state, time_limit, workers, virtual_loss=VIRTUAL_LOSS, max_nodes=MAX_NODES):
+    """
+    Grows one shared tree from state with the given number of worker processes for time_limit
+    seconds.  Returns the root action with the best average (as mcts_uct0 does), the number of
+    rollouts played, the number of collisions, and the dict of root action to (visits, value).
+    """
+
+    tree = SharedTree(max_nodes)
+    try:
+        # the root is node 0
+        tree.header[0] = 1
+        for field in range(FIELDS):
+            tree.ints[field] = 0
+        tree.values[0] = 0.0
+
+        context = multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods() else None)
+        locks = [context.Lock() for i in range(LOCK_STRIPES)]
+        alloc_lock = context.Lock()
+        results = context.Queue()
+        end_time = time.time() + time_limit
+        processes = [context.Process(target=worker, args=(tree.name, max_nodes, state, end_time, locks, alloc_lock, virtual_loss, results))
+                     for i in range(workers)]
+        for process in processes:
+            process.start()
+        counts = collect_results(results, processes, end_time + RESULT_GRACE)
+
+        playouts = sum(count[0] for count in counts)
+        collisions = sum(count[1] for count in counts)
+        size = len(state.board())
+        statistics = {}
+        first = tree.ints[FIRST_CHILD]
+        for child in range(first, first + tree.ints[CHILD_COUNT]):
+            visits = tree.ints[child * FIELDS + VISITS]
+            if visits > 0:
+                statistics[divmod(tree.ints[child * FIELDS + ACTION], size)] = (visits, tree.values[child])
+    finally:
+        tree.close()
+        tree.shm.unlink()
+
+    # No rollout reached the root's children (every worker died or the time was too short)
+    if not statistics:
+        return random.choice(state.get_actions()), playouts, collisions, statistics
+
+    # Player 0 = maximize, player 1 = minimize; ties are broken at random
+    factor = 1 if state.actor() == 0 else -1
+    best_avg = max(factor * value / visits for visits, value in statistics.values())
+    best_moves = [action for action, (visits, value) in statistics.items() if factor * value / visits == best_avg]
+    return random.choice(best_moves), playouts, collisions, statistics
+
+
+def mcts_policy(time_limit, workers=4, virtual_loss=VIRTUAL_LOSS):
+    """
+    Returns a function that takes a position and returns the move suggested by growing one tree
+    with the given number of worker processes for time_limit seconds
+    """
+    def policy(position):
+        return tree_parallel_search(position, time_limit, workers, virtual_loss)[0]
+    return policy
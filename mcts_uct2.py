@@ -1,10 +1,15 @@
 import time
 import math
-import random
+from array import array
+from playout import random_playouts
+from state_table import StateTable
 
 # Weight for UCB heuristic
 UCB_EXPLORE_WEIGHT = 2
 
+# Visits between updates of the principal path pinned in the state table
+PIN_INTERVAL = 64
+
 def start_payoff(state, start_actor):
     """Maintains minimization or maximization for p0 or p1"""
 
@@ -27,20 +32,17 @@ def explore_calculate(total_plays, state_plays):
     return ans
     
 
-def ucb(parent, succ, total_plays, states, actor, start_actor):
-    """Calculates the UCB heuristic for a node"""
+def ucb(edge_plays, succ_entry, total_plays, actor, start_actor):
+    """Calculates the UCB heuristic for the child with entry succ_entry, reached edge_plays times"""
 
     # Check if it hasn't been visited from the parent node before
-    if succ not in states or states[parent][2][succ] == 0 or states[succ][1] == 0 or total_plays == 0:
+    if succ_entry is None or edge_plays == 0 or succ_entry[1] == 0 or total_plays == 0:
         return None
     
-    # If terminal then return some payoff
-    if succ.is_terminal():
-        return 10 * start_payoff(succ, start_actor)
-    
     # Otherwise, calculate exploit and explore terms for UCB heuristics
-    exploit = (states[succ][0] / states[succ][1])
-    explore = explore_calculate(total_plays, states[parent][2][succ])
+    # -> terminal children never get an entry, so they are always treated as unvisited
+    exploit = (succ_entry[0] / succ_entry[1])
+    explore = explore_calculate(total_plays, edge_plays)
 
     # Get respective heuristic given p0 or p1
     if actor == start_actor:
@@ -49,92 +51,110 @@ def ucb(parent, succ, total_plays, states, actor, start_actor):
         return explore - exploit
     
 
-def max_ucb(state, states, start_actor):
-    """Gets the best node from UCB heuristics"""
+def max_ucb(pos, states, start_actor):
+    """Gets the index of the best edge of pos's entry from UCB heuristics"""
 
     # Initialize best values
     best_ucb = None
-    best_succ = None
-    actor = state.actor()
-    total_plays = states[state][1]
+    best_index = None
+    actor = pos.actor()
+    entry = states[pos.key]
+    total_plays = entry[1]
 
-    # Go through actions and get UCB value
-    for action in state.get_actions():
-        succ = state.successor(action)
+    # Go through the cached edges and get UCB value -> no successor states are built
+    for index, succ_key in enumerate(entry[3]):
+        succ_entry = states[succ_key] if succ_key in states else None
 
         # Get UCB value
-        ucb_val = ucb(state, succ, total_plays, states, actor, start_actor)
+        ucb_val = ucb(entry[4][index], succ_entry, total_plays, actor, start_actor)
 
         # If none, then hasn't been visited to select this
         if ucb_val is None:
-            return succ, None
+            return index, None
         
         # Otherwise, has been traversed
         if best_ucb is None or ucb_val > best_ucb:
             best_ucb = ucb_val
-            best_succ = succ
+            best_index = index
     
-    # Return best node
-    return best_succ, best_ucb
+    # Return best edge
+    return best_index, best_ucb
 
-def create_entry(state, states):
+def create_entry(pos, states):
     """Function to create an entry in the implicit tree"""
 
-    # Check if not already inside implicit tree
-    if state not in states:
+    # Check if not already inside implicit tree -> keyed by Zobrist key
+    if pos.key not in states:
+
+        # Store value, visits, and the edges as compact arrays: action (x * board size + y),
+        # successor key from the Zobrist key arithmetic, and visits along the edge
+        actions = pos.get_actions()
+        size = len(pos.board())
+        states[pos.key] = [0, 0,
+                           array('H', [x * size + y for x, y in actions]),
+                           array('Q', [pos.successor_key(action) for action in actions]),
+                           array('I', bytes(4 * len(actions)))]
+
+def edge_action(pos, entry, index):
+    """Returns the action of an entry's edge"""
 
-        # Store value, visits, and map from succesive action to visits (maintains edges)
-        states[state] = [0, 0, dict()]
-        for action in state.get_actions():
-            states[state][2][state.successor(action)] = 0
+    return divmod(entry[2][index], len(pos.board()))
 
 def simulate(state, start_actor):
     """Gets the terminal value from random actions"""
 
-    # Continue until terminal
-    while not state.is_terminal():
-        # Choose random aciton
-        action = random.choice(state.get_actions())
-        state = state.successor(action)
+    # Play random actions until terminal on the playout engine's flat board
+    value = random_playouts(state)[0]
     
     # Return terminal value
-    return start_payoff(state, start_actor)
+    return value if start_actor == 0 else -1 * value
 
-def visit(start_state, states, start_actor):
-    """Traverses the Monte Carlo Tree to gather statistics"""
+def visit(pos, states, start_actor):
+    """Traverses the Monte Carlo Tree to gather statistics, playing the moves on pos and taking
+    them back afterwards"""
 
-    # Traverse from current state
-    curr_state = start_state
-
-    # Record previous states for backpropagation
-    past_states = [start_state]
+    # Record keys of previous positions and the edges between them for backpropagation
+    past_keys = [pos.key]
+    past_edges = []
+    moves = 0
 
     # Expand: Only if leaf is not terminal -> using ucb heuristic
-    while not curr_state.is_terminal():
-        curr_state, action_ucb = max_ucb(curr_state, states, start_actor)
+    while not pos.is_terminal():
+        index, action_ucb = max_ucb(pos, states, start_actor)
+        pos.play(edge_action(pos, states[pos.key], index))
+        moves += 1
         if action_ucb is None:
             break
-        past_states.append(curr_state)
+        past_edges.append(index)
+        past_keys.append(pos.key)
 
     # Rollout/simulate: Play from leaf node
-    if curr_state.is_terminal():
+    if pos.is_terminal():
         # Terminal state
-        value = start_payoff(curr_state, start_actor)
+        value = start_payoff(pos, start_actor)
     else:
         # Child without an entry yet
-        create_entry(curr_state, states)
-        past_states.append(curr_state)
-        value = simulate(curr_state, start_actor)
+        create_entry(pos, states)
+        past_edges.append(index)
+        past_keys.append(pos.key)
+        value = simulate(pos, start_actor)
     
-    # Backpropagate
-    for i in range(len(past_states)):
+    # Backpropagate, marking the entries on the selected path as recently visited
+    for i in range(len(past_keys)):
+        states.touch(past_keys[i])
+        entry = states[past_keys[i]]
+
         # Add visit count along edges for UCT2 implementation
-        if i > 0:
-            states[past_states[i - 1]][2][past_states[i]] += 1
+        if i < len(past_edges):
+            entry[4][past_edges[i]] += 1
         
         # Add visit and value to node to calculate average value
-        states[past_states[i]][0] += value
-        states[past_states[i]][1] += 1
+        entry[0] += value
+        entry[1] += 1
+
+    # Back to the start position
+    for i in range(moves):
+        pos.undo()
 
 def mcts(start_state, time_limit, states):
     """Returns the best move from MCTS"""
@@ -142,32 +162,41 @@ def mcts(start_state, time_limit, states):
     # Get start time
     start_time = time.process_time()
     
-    # Create root entry and player
-    create_entry(start_state, states)
-    start_actor = start_state.actor()
+    # Create root entry and player, on a mutable position the visits play their moves on
+    pos = start_state.position()
+    create_entry(pos, states)
+    start_actor = pos.actor()
 
-    # While time limit is not up continue to traverse
+    # While time limit is not up continue to traverse, evicting old entries once each visit is backed up
+    visits = 0
     while (time.process_time() - start_time < time_limit):
-        visit(start_state, states, start_actor)
+        if visits % PIN_INTERVAL == 0:
+            states.pin(pos.key)
+        visit(pos, states, start_actor)
+        states.evict()
+        visits += 1
     
     # Get best move from MCTS statistics
     ans = None
     ans_val = None
 
-    # Traverse actions
-    for action in start_state.get_actions():
+    # Traverse the root's edges -> the root is pinned, so its entry is still there
+    entry = states[pos.key]
+    for index, succ_key in enumerate(entry[3]):
+        action = edge_action(pos, entry, index)
 
         # Get statistics
-        succ = start_state.successor(action)
-        if succ.is_terminal():
+        pos.play(action)
+        if pos.is_terminal():
             # If terminal then return value
-            val = start_payoff(succ, start_actor)
+            val = start_payoff(pos, start_actor)
 
-        elif succ in states and states[succ][1] != 0:
+        elif succ_key in states and states[succ_key][1] != 0:
             # If visited then return average value
-            val = states[succ][0] / states[succ][1]
+            val = states[succ_key][0] / states[succ_key][1]
         else:
             val = None
+        pos.undo()
 
         # Check if statistics are better than prior moves
         if ans_val is None or (val is not None and val > ans_val):
@@ -178,11 +207,20 @@ def mcts(start_state, time_limit, states):
     return ans
 
 
-def mcts_policy(time_limit):
-    """Returned mcts policy"""
+def mcts_policy(time_limit, max_megabytes=64, max_entries=None, report=False):
+    """Returned mcts policy
+    max_megabytes, max_entries -> caps on the state table kept for the whole game (None for no cap)
+    report -> print the state table's size, evictions and hit rate after each move"""
+
+    # Table to store implicit tree, keyed by each state's Zobrist key
+    states_memo = StateTable(max_entries, max_megabytes)
 
-    # Dictionary to store implicit tree
-    states_memo = dict()
+    def policy(pos):
+        """Returned function"""
 
-    # Return best move from MCTS UCT2 implementation
-    return lambda pos : mcts(pos, time_limit, states_memo)
\ No newline at end of file
+        # Return best move from MCTS UCT2 implementation
+        move = mcts(pos, time_limit, states_memo)
+        if report:
+            print(f"uct2: {move}, state table: {states_memo.stats()}")
+        return move
+    return policy
\ No newline at end of file
@@ -1,12 +1,15 @@
 import time
 import math
-import random
-import collections
-import concurrent.futures
+from playout import lockstep_playouts
+from rollout_pool import get_pool, ROLLOUTS_PER_LEAF, WORKERS
 
 # Weight for UCB heuristic
 UCB_EXPLORE_WEIGHT = 2
 
+# RAVE equivalence parameter -> the number of visits at which a state's own average and the AMAF
+# average of the move to it get equal weight in selection
+RAVE_EQUIVALENCE = 1000
+
 def start_payoff(state, start_actor):
     """Maintains minimization or maximization for p0 or p1"""
 
@@ -29,11 +32,30 @@ def explore_calculate(total_plays, state_plays):
     return ans
     
 
-def ucb(parent, succ, total_plays, states, actor, start_actor):
-    """Calculates the UCB heuristic for a node"""
+def rave_beta(visits, amaf_visits):
+    """Share of the exploit term taken from the AMAF average of the move into a state -> all of it
+    before the state is visited, shrinking once its own visits pass RAVE_EQUIVALENCE"""
+
+    if amaf_visits == 0:
+        return 0
+    return amaf_visits / (visits + amaf_visits + visits * amaf_visits / RAVE_EQUIVALENCE)
+
+def blended_avg(parent, succ, states, action):
+    """Average value of succ blended with the parent's AMAF average for the action leading to it"""
+
+    avg = states[succ.key][0] / states[succ.key][1]
+    amaf_value, amaf_visits = states[parent.key][3].get(action, (0, 0))
+    if amaf_visits:
+        beta = rave_beta(states[succ.key][1], amaf_visits)
+        avg = (1 - beta) * avg + beta * amaf_value / amaf_visits
+    return avg
+
+def ucb(parent, succ, total_plays, states, actor, start_actor, action):
+    """Calculates the UCB heuristic for a node, blending its average with the parent's AMAF
+    average for the action leading to it"""
 
     # Check if it hasn't been visited from the parent node before
-    if succ not in states or states[parent][2][succ] == 0 or states[succ][1] == 0 or total_plays == 0:
+    if succ.key not in states or states[parent.key][2][succ.key] == 0 or states[succ.key][1] == 0 or total_plays == 0:
         return None
     
     # If terminal then return some payoff
@@ -41,8 +63,8 @@ def ucb(parent, succ, total_plays, states, actor, start_actor):
         return 10 * start_payoff(succ, start_actor)
     
     # Otherwise, calculate exploit and explore terms for UCB heuristics
-    exploit = (states[succ][0] / states[succ][1])
-    explore = explore_calculate(total_plays, states[parent][2][succ])
+    exploit = blended_avg(parent, succ, states, action)
+    explore = explore_calculate(total_plays, states[parent.key][2][succ.key])
 
     # Get respective heuristic given p0 or p1
     if actor == start_actor:
@@ -59,14 +81,14 @@ def max_ucb(state, states, start_actor):
     best_succ = None
     best_action = None
     actor = state.actor()
-    total_plays = states[state][1]
+    total_plays = states[state.key][1]
 
     # Go through actions and get UCB value
     for action in state.get_actions():
         succ = state.successor(action)
 
         # Get UCB value
-        ucb_val = ucb(state, succ, total_plays, states, actor, start_actor)
+        ucb_val = ucb(state, succ, total_plays, states, actor, start_actor, action)
 
         # If none, then hasn't been visited to select this
         if ucb_val is None:
@@ -78,106 +100,128 @@ def max_ucb(state, states, start_actor):
             best_succ = succ
             best_action = action
     
-    # Return best node and action for AMAF
+    # Return best node and action for RAVE
     return best_action, best_succ, best_ucb
 
 def create_entry(state, states):
     """Function to create an entry in the implicit tree"""
 
-    # Check if not already inside implicit tree
-    if state not in states:
+    # Check if not already inside implicit tree -> keyed by Zobrist key
+    if state.key not in states:
 
-        # Store value, visits, and map from succesive action to visits (maintains edges)
-        states[state] = [0, 0, dict()]
+        # Store value, visits, map from succesive key to visits (maintains edges), and RAVE
+        # statistics: map from each action of the player to move to [value, visits] over the
+        # simulations through this state that played it later on
+        states[state.key] = [0, 0, dict(), dict()]
         for action in state.get_actions():
-            states[state][2][state.successor(action)] = 0
-
-def simulate(state, start_actor, amaf_memo):
-    """Gets the terminal value from random actions"""
-
-    # Maintain a list of actions for AMAF
-    amaf_actions = []
-
-    # Continue until terminal
-    while not state.is_terminal():
-        # Choose random action
-        action = random.choice(state.get_actions())
-        state = state.successor(action)
-
-        # Check if action in existing tree, if so then add value
-        if action in amaf_memo:
-            amaf_actions.append(action)
-
-    # Return terminal value
-    return start_payoff(state, start_actor), amaf_actions
-
-def visit(start_state, states, start_actor, amaf_memo):
-    """Traverses the Monte Carlo Tree to gather statistics"""
+            states[state.key][2][state.successor(action).key] = 0
+
+def simulate(state, start_actor, rollouts=ROLLOUTS_PER_LEAF, workers=WORKERS):
+    """Gets the terminal values from random actions on the rollout pool
+    Returns (value, moves played) for each rollout"""
+
+    # Play random actions until terminal on the persistent pool of worker processes
+    payoffs, move_lists = get_pool(workers).playouts(state, rollouts)
+
+    # Return terminal values for the start actor
+    sign = 1 if start_actor == 0 else -1
+    return [(sign * v, moves) for v, moves in zip(payoffs, move_lists)]
+
+def update_amaf(results, states, past_states, past_actions):
+    """Adds rollout results to the RAVE statistics of the states on the selected path and returns
+    the total value -> a state counts every action its player to move played later on
+    results -> list of (value, moves played) for each rollout
+    past_actions -> moves from the start state down the path, including any move past its last state"""
+
+    value = 0
+    for v, moves in results:
+        value += v
+        for depth, state in enumerate(past_states):
+            amaf = states[state.key][3]
+
+            # The moves of this state's player are every other move of the simulation from here
+            for action in (past_actions[depth:] + moves)[::2]:
+                stats = amaf.get(action)
+                if stats is None:
+                    amaf[action] = [v, 1]
+                else:
+                    stats[0] += v
+                    stats[1] += 1
+    return value
+
+def visit(start_state, states, start_actor, lockstep=None, rollouts=ROLLOUTS_PER_LEAF, workers=WORKERS):
+    """Traverses the Monte Carlo Tree to gather statistics
+    lockstep -> if given, number of rollouts played at once with NumPy instead of on the rollout pool
+    rollouts, workers -> rollouts per leaf and worker processes for the rollout pool"""
 
     # Traverse from current state
     curr_state = start_state
 
-    # Record previous states for backpropagation
+    # Record previous states for backpropagation, and the moves between them for RAVE
     past_states = [start_state]
+    past_actions = []
 
     # Expand: Only if leaf is not terminal -> using ucb heuristic
     while not curr_state.is_terminal():
         action, curr_state, action_ucb = max_ucb(curr_state, states, start_actor)
+        past_actions.append(action)
         if action_ucb is None:
             break
         past_states.append(curr_state)
     
+    # Visits added per node -> each rollout counts as a visit
+    visits = 1
+
     # Rollout/simulate: Play from leaf node
     if curr_state.is_terminal():
-        # Terminal state
-        value = start_payoff(curr_state, start_actor)
-    else:
-        # Add move to amaf memo
-        amaf_memo[action].add(curr_state)
-
+        # Terminal state -> the moves down the path still count for RAVE
+        value = update_amaf([(start_payoff(curr_state, start_actor), [])], states, past_states, past_actions)
+    elif lockstep:
         # Child without an entry yet
         create_entry(curr_state, states)
         past_states.append(curr_state)
 
-        # Perform 4 parallel rollouts
-        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-            futures = [executor.submit(simulate, curr_state, start_actor, amaf_memo) for _ in range(4)]
+        # Perform lockstep rollouts as rows of one NumPy array
+        payoffs, move_lists = lockstep_playouts(curr_state, lockstep, record_moves=True)
+        sign = 1 if start_actor == 0 else -1
+        results = [(sign * v, moves) for v, moves in zip(payoffs, move_lists)]
+        value = update_amaf(results, states, past_states, past_actions)
+        visits = lockstep
+    else:
+        # Child without an entry yet
+        create_entry(curr_state, states)
+        past_states.append(curr_state)
 
-            # Wait for all rollouts to complete and collect the results
-            results = [future.result() for future in concurrent.futures.as_completed(futures)]
+        # Perform the rollouts in parallel on the worker processes
+        results = simulate(curr_state, start_actor, rollouts, workers)
 
-        # Update AMAF nodes
-        value = 0
-        for v, amaf_actions in results:
-            value += v
-            for action in amaf_actions:
-                for stat in amaf_memo[action]:
-                    states[stat][0] += v
-                    states[stat][1] += 1
+        # Update RAVE statistics along the path
+        value = update_amaf(results, states, past_states, past_actions)
+        visits = rollouts
 
     # Backpropagate
     for i in range(len(past_states)):
         # Add visit count along edges for UCT2 implementation
         if i > 0:
-            states[past_states[i - 1]][2][past_states[i]] += 1
+            states[past_states[i - 1].key][2][past_states[i].key] += 1
         
         # Add visit and value to node to calculate average value
-        states[past_states[i]][0] += value
-        states[past_states[i]][1] += 1
+        states[past_states[i].key][0] += value
+        states[past_states[i].key][1] += visits
 
-def mcts(start_state, time_limit, states, amaf_memo):
+def mcts(start_state, time_limit, states, lockstep=None, rollouts=ROLLOUTS_PER_LEAF, workers=WORKERS):
     """Returns the best move from MCTS"""
 
-    # Get start time
-    start_time = time.process_time()
+    # Get start time -> wall clock, since the rollouts run in other processes
+    start_time = time.time()
 
     # Create root entry and player
     create_entry(start_state, states)
     start_actor = start_state.actor()
 
     # While time limit is not up continue to traverse
-    while (time.process_time() - start_time < time_limit):
-        visit(start_state, states, start_actor, amaf_memo)
+    while (time.time() - start_time < time_limit):
+        visit(start_state, states, start_actor, lockstep, rollouts, workers)
     
     # Get best move from MCTS statistics
     ans = None
@@ -192,9 +236,9 @@ def mcts(start_state, time_limit, states, amaf_memo):
             # If terminal then return value
             val = start_payoff(succ, start_actor)
 
-        elif succ in states and states[succ][1] != 0:
-            # If visited then return average value
-            val = states[succ][0] / states[succ][1]
+        elif succ.key in states and states[succ.key][1] != 0:
+            # If visited then return average value, blended with AMAF as in selection
+            val = blended_avg(start_state, succ, states, action)
         else:
             val = None
         
@@ -207,14 +251,14 @@ def mcts(start_state, time_limit, states, amaf_memo):
     return ans
 
 
-def mcts_policy(time_limit):
-    """Returned mcts policy"""
+def mcts_policy(time_limit, lockstep=None, rollouts=ROLLOUTS_PER_LEAF, workers=WORKERS):
+    """Returned mcts policy
+    lockstep -> number of NumPy lockstep rollouts per leaf, or None for rollouts on the rollout pool
+    rollouts, workers -> rollouts per leaf and worker processes for the rollout pool, which is
+    started once and kept for every later move"""
 
-    # Dictionary to store implicit tree
+    # Dictionary to store implicit tree, keyed by each state's Zobrist key -> each entry keeps its own RAVE statistics
     states_memo = dict()
 
-    # Dictionary to store moves for all moves as first
-    amaf_memo = collections.defaultdict(set)
-
-    # Return best move from MCTS UCT2 implementation with AMAF and leaf parallelization
-    return lambda pos : mcts(pos, time_limit, states_memo, amaf_memo)
\ No newline at end of file
+    # Return best move from MCTS UCT2 implementation with RAVE and leaf parallelization
+    return lambda pos : mcts(pos, time_limit, states_memo, lockstep, rollouts, workers)
\ No newline at end of file
@@ -1,4 +1,8 @@
 import time
+import math
+import line_table
+import transposition
+import search
 
 START_ALPHA = float("-inf")
 START_BETA = float("inf")
@@ -66,8 +70,14 @@ def evaluate_direction(board, range_start, range_end, iterator, weight_rows, wei
             total += factor * weight_rows[count - 1] * weight_space[blanks_before + count + blanks_after - 5]
     return total
 
-# returns values for player 0
+# returns values for player 0, by looking up the score of each line in a table built for the weights
 def heuristic(state, weight_rows, weight_space):
+    if state.is_terminal():
+        return state.payoff() * WEIGHT_WIN
+    return line_table.get_table(weight_rows, weight_space, BOARD_SIZE).evaluate(state.board())
+
+# same value as heuristic, computed by scanning every line of the board
+def scan_heuristic(state, weight_rows, weight_space):
     if state.is_terminal():
         return state.payoff() * WEIGHT_WIN
     total = 0
@@ -76,14 +86,34 @@ def heuristic(state, weight_rows, weight_space):
         total += evaluate_direction(board, start, end, iterator, weight_rows, weight_space)
     return total
 
+# plays action on pos and on the evaluator that tracks its heuristic value
+def play(pos, evaluator, action):
+    evaluator.add(action, pos.actor())
+    pos.play(action)
+
+# takes back the last move played on pos and its evaluator
+def undo(pos, evaluator):
+    pos.undo()
+    evaluator.pop()
+
+# heuristic value of pos for player 0, read from its evaluator instead of rescanning the board
+def evaluate(pos, evaluator):
+    if pos.is_terminal():
+        return pos.payoff() * WEIGHT_WIN
+    return evaluator.value()
+
 def greedy(state, weight_rows, weight_space):
     factor = 1 if state.actor() == 0 else -1
     best_val = None
     best_action = None
-    actions = state.get_actions()
+    pos = state.position()
+    evaluator = line_table.get_table(weight_rows, weight_space, BOARD_SIZE).evaluator(pos.board())
+    actions = pos.get_actions()
     # random.shuffle(actions)
     for action in actions:
-        val = heuristic(state.successor(action), weight_rows, weight_space)
+        play(pos, evaluator, action)
+        val = evaluate(pos, evaluator)
+        undo(pos, evaluator)
         if best_val is None or val * factor > best_val:
             best_val = val * factor
             best_action = action
@@ -93,51 +123,185 @@ def greedy(state, weight_rows, weight_space):
 def greedy_policy(weight_rows, weight_space):
     return lambda pos : greedy(pos, weight_rows, weight_space)
 
-def minimax(state, max_time, weight_rows, weight_space):
-    factor = 1 if state.actor() == 0 else -1
-    depth = 1
+def minimax(state, max_time, weight_rows, weight_space, table=None, context=None, max_depth=None):
     start_time = time.time()
-    while (time.time() - start_time < max_time):
-        best_action = None
-        best_val = None
-        actions = state.get_actions()
-        # random.shuffle(actions)
-        for action in actions:
-            succ = state.successor(action)
-            val = alphabeta(succ, depth, START_ALPHA, START_BETA, weight_rows, weight_space)
-            if best_val is None or val * factor > best_val:
-                best_val = val * factor
-                best_action = action
+    pos = state.position()
+    evaluator = line_table.get_table(weight_rows, weight_space, BOARD_SIZE).evaluator(pos.board())
+    # results remembered between iterations (and between moves if the table is passed in).  A
+    # search.Search can be passed in instead to choose the search options and read its counts
+    if context is None:
+        context = search.Search(table if table is not None else transposition.TranspositionTable())
+    if context.table is not None:
+        context.table.new_search()
+    actions = context.order(pos)
+    best_action = None
+    # values of the completed iterations, for the aspiration window
+    iteration_vals = []
+    depth = 1
+    while best_action is None or (time.time() - start_time < max_time and (max_depth is None or depth <= max_depth)):
+        # aspiration window around the value from two iterations ago, since the heuristic swings
+        # between odd and even depths, opened up on the side the value falls outside of
+        alpha, beta = START_ALPHA, START_BETA
+        if len(iteration_vals) >= 2 and context.aspiration is not None:
+            alpha, beta = iteration_vals[-2] - context.aspiration, iteration_vals[-2] + context.aspiration
+        try:
+            while True:
+                iteration_action, iteration_val, values = search_root(pos, depth, alpha, beta, evaluator, context, actions)
+                if iteration_val <= alpha:
+                    alpha = START_ALPHA
+                elif iteration_val >= beta:
+                    beta = START_BETA
+                else:
+                    break
+        except search.SearchTimeout:
+            # pos and evaluator are left mid-search, but they are not used again
+            break
+        best_action = iteration_action
+        iteration_vals.append(iteration_val)
+        # in plies counting the move from the root, the depth of 2 the first iteration always reaches
+        context.depth = depth + 1
+        # a won or lost position will not change with more depth
+        if abs(iteration_val) >= WEIGHT_WIN:
+            break
+        # the first iteration always finishes so there is a move to return; later ones stop at the deadline
+        context.deadline = start_time + max_time
+        # the next iteration searches the best moves of this one first
+        factor = 1 if pos.actor() == 0 else -1
+        actions.sort(key=lambda action: values[action] * factor, reverse=True)
         depth += 1
     return best_action
-            
 
+# searches every move from pos to depth within the window (alpha, beta).  Returns the best move, its
+# value for player 0, and the value of every move, which is only a bound for moves that were not
+# better than the best when the window is narrowed for principal variation search
+def search_root(pos, depth, alpha, beta, evaluator, context, actions):
+    maximizing = pos.actor() == 0
+    best_action = None
+    best_val = None
+    values = {}
+    for action in actions:
+        play(pos, evaluator, action)
+        val = search_child(pos, depth, alpha, beta, evaluator, context, best_action is None, maximizing)
+        undo(pos, evaluator)
+        values[action] = val
+        if best_action is None or (val > best_val if maximizing else val < best_val):
+            best_action = action
+            best_val = val
+        if context.pvs:
+            # later moves only have to be shown to be no better than the best so far
+            if maximizing:
+                alpha = max(alpha, val)
+            else:
+                beta = min(beta, val)
+    return best_action, best_val, values
 
-def alphabeta(state, depth, alpha, beta, weight_rows, weight_space):
-    if state.is_terminal():
-        return WEIGHT_WIN * state.payoff()
-    if depth == 0:
-        return heuristic(state, weight_rows, weight_space)
-    curr_actor = state.actor()
+# searches pos, reached by a move of the maximizing or minimizing player, to depth.  With principal
+# variation search, moves after the first get a null window just past the bound they have to beat,
+# and are searched again with the full window only if they beat it.  A reduced move is first
+# searched one ply shallower with the null window, and at full depth only if it beats the bound
+def search_child(pos, depth, alpha, beta, evaluator, context, first, maximizing, reduced=False):
+    if reduced and depth > 1:
+        context.reductions += 1
+        if maximizing:
+            val = alphabeta(pos, depth - 1, alpha, math.nextafter(alpha, START_BETA), evaluator, context)
+            if val <= alpha:
+                return val
+        else:
+            val = alphabeta(pos, depth - 1, math.nextafter(beta, START_ALPHA), beta, evaluator, context)
+            if val >= beta:
+                return val
+        context.reduction_researches += 1
+    if first or depth == 0 or not context.pvs:
+        return alphabeta(pos, depth, alpha, beta, evaluator, context)
+    if maximizing:
+        val = alphabeta(pos, depth, alpha, math.nextafter(alpha, START_BETA), evaluator, context)
+    else:
+        val = alphabeta(pos, depth, math.nextafter(beta, START_ALPHA), beta, evaluator, context)
+    if alpha < val < beta:
+        context.researches += 1
+        val = alphabeta(pos, depth, alpha, beta, evaluator, context)
+    return val
+            
+# value of pos for player 0 searched to depth.  context holds the transposition table and the move
+# ordering tables, counts the nodes searched, and raises search.SearchTimeout once past its deadline
+def alphabeta(pos, depth, alpha, beta, evaluator, context):
+    context.nodes += 1
+    if context.nodes >= context.next_check:
+        context.check_time()
+    if pos.is_terminal():
+        return WEIGHT_WIN * pos.payoff()
+    table = context.table
+    if table is None:
+        if depth == 0:
+            return evaluate(pos, evaluator)
+        entry = None
+    else:
+        entry = table.probe(pos.key)
+        if depth == 0:
+            # leaves are stored too, since moves played in a different order often reach the same leaf
+            if entry is not None and entry[3] == transposition.EXACT:
+                return entry[2]
+            value = evaluator.value()
+            table.store(pos.key, 0, value, transposition.EXACT, None)
+            return value
+        if entry is not None and entry[1] >= depth:
+            value, bound = entry[2], entry[3]
+            if bound == transposition.EXACT or (bound == transposition.LOWER and value >= beta) or (bound == transposition.UPPER and value <= alpha):
+                return value
+    alpha_start, beta_start = alpha, beta
+    best_action = None
+    # the best move stored for this position is tried first, even from a shallower search
+    actions = context.order(pos, entry[4] if entry is not None else None)
+    actions, reducible = context.select(pos, actions, evaluator, depth)
+    curr_actor = pos.actor()
     if curr_actor == 0:
         a = START_ALPHA
-        for action in state.get_actions():
+        for action in actions:
+            play(pos, evaluator, action)
+            val = search_child(pos, depth - 1, alpha, beta, evaluator, context, best_action is None, True, action in reducible)
+            undo(pos, evaluator)
+            if best_action is None or val > a:
+                a = val
+                best_action = action
+            alpha = max(alpha, a)
             if alpha >= beta:
+                context.cutoff(pos, action, depth)
                 break
-            successor = state.successor(action)
-            a = max(a, alphabeta(successor, depth - 1, alpha, beta, weight_rows, weight_space))
-            alpha = max(alpha, a)
-        return a
+        value = a
     else:
         b = START_BETA
-        for action in state.get_actions():
+        for action in actions:
+            play(pos, evaluator, action)
+            val = search_child(pos, depth - 1, alpha, beta, evaluator, context, best_action is None, False, action in reducible)
+            undo(pos, evaluator)
+            if best_action is None or val < b:
+                b = val
+                best_action = action
+            beta = min(beta, b)
             if alpha >= beta:
+                context.cutoff(pos, action, depth)
                 break
-            successor = state.successor(action)
-            b = min(b, alphabeta(successor, depth - 1, alpha, beta, weight_rows, weight_space))
-            beta = min(beta, b)
-        return b
+        value = b
+    if table is not None:
+        if value <= alpha_start:
+            bound = transposition.UPPER
+        elif value >= beta_start:
+            bound = transposition.LOWER
+        else:
+            bound = transposition.EXACT
+        table.store(pos.key, depth, value, bound, best_action)
+    return value
 
 
-def minimax_policy(max_time, weight_rows, weight_space):
-    return lambda pos : minimax(pos, max_time, weight_rows, weight_space)
\ No newline at end of file
+# top_k turns on top-K pruning, and report prints the depth reached and the nodes searched for each move
+def minimax_policy(max_time, weight_rows, weight_space, top_k=None, report=False):
+    # one table for the whole game, so positions searched for earlier moves are remembered
+    table = transposition.TranspositionTable()
+    def policy(pos):
+        context = search.Search(table, top_k=top_k)
+        start_time = time.time()
+        action = minimax(pos, max_time, weight_rows, weight_space, context=context)
+        if report:
+            print(f"minimax: {action} at depth {context.depth} in {time.time() - start_time:.2f} s ({context.stats()})")
+        return action
+    return policy
\ No newline at end of file
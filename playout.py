@@ -0,0 +1,259 @@
+import random
+import threading
+
+# NumPy is only needed for lockstep_playouts
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Values stored on the playout board: -1 and 0/1 as in Gomoku.State, plus a border value that
+# surrounds the board so neighbor and line walks never need bounds checks
+EMPTY = -1
+BORDER = 2
+
+
+class PlayoutEngine:
+    """Plays uniformly random games to the end from a position, as MonteCarloTree.rollout does
+    with successor(), but on a flat preallocated board.  The legal moves are kept in a list with
+    an index map so a move is picked and removed in O(1), and only the four lines through the
+    last stone are checked for five in a row."""
+
+    def __init__(self, board_size):
+        self.board_size = board_size
+        self.width = board_size + 2
+        cells = self.width * self.width
+
+        # Offsets of the eight neighbors and of the four line directions on the flat board
+        w = self.width
+        self.neighbor_offsets = (-w - 1, -w, -w + 1, -1, 1, w - 1, w, w + 1)
+        self.line_offsets = (1, w, w + 1, w - 1)
+
+        # (x, y) action for each flat index
+        self.actions = [(i // w - 1, i % w - 1) for i in range(cells)]
+
+        # Buffers reset from the loaded position at the start of every game
+        self.base = [BORDER] * cells
+        self.board = [BORDER] * cells
+        self.base_frontier = []
+        self.frontier = []
+        self.base_where = [-1] * cells
+        self.where = [-1] * cells
+        self.turn = 0
+        self.payoff = None
+
+    def load(self, state):
+        """Copies the position of a Gomoku.State, Gomoku.BitState or Gomoku.Position"""
+
+        w = self.width
+        for x, row in enumerate(state.board()):
+            self.base[(x + 1) * w + 1:(x + 1) * w + 1 + self.board_size] = row
+        self.load_cells(self.base, state.actor())
+        self.payoff = state.payoff() if state.is_terminal() else None
+
+    def load_cells(self, cells, turn):
+        """Copies a nonterminal position given as a flat bordered board in this engine's layout"""
+
+        self.base[:] = cells
+        self.base_frontier = []
+        self.base_where = [-1] * len(self.base)
+        for i, space in enumerate(self.base):
+            if space == EMPTY and any(self.base[i + d] in (0, 1) for d in self.neighbor_offsets):
+                self.base_where[i] = len(self.base_frontier)
+                self.base_frontier.append(i)
+
+        self.turn = turn
+        self.payoff = None
+
+    def play(self, moves=None):
+        """Plays one random game from the loaded position and returns the payoff for player 0.
+        If moves is a list, the actions played are appended to it."""
+
+        if self.payoff is not None:
+            return self.payoff
+
+        board = self.board
+        frontier = self.frontier
+        where = self.where
+        board[:] = self.base
+        frontier[:] = self.base_frontier
+        where[:] = self.base_where
+        neighbor_offsets = self.neighbor_offsets
+        line_offsets = self.line_offsets
+        rand = random.random
+        player = self.turn
+
+        while frontier:
+            # Pick a random legal move and swap-remove it from the frontier
+            r = int(rand() * len(frontier))
+            idx = frontier[r]
+            last = frontier.pop()
+            if last != idx:
+                frontier[r] = last
+                where[last] = r
+            where[idx] = -1
+            board[idx] = player
+            if moves is not None:
+                moves.append(self.actions[idx])
+
+            # Five in a row can only go through the stone just placed
+            for d in line_offsets:
+                count = 1
+                j = idx + d
+                while board[j] == player:
+                    count += 1
+                    j += d
+                j = idx - d
+                while board[j] == player:
+                    count += 1
+                    j -= d
+                if count >= 5:
+                    return 1 if player == 0 else -1
+
+            # Empty neighbors of the new stone become legal moves
+            for d in neighbor_offsets:
+                j = idx + d
+                if board[j] == EMPTY and where[j] < 0:
+                    where[j] = len(frontier)
+                    frontier.append(j)
+
+            player = 1 - player
+
+        # No legal moves left means a draw
+        return 0
+
+
+# One engine per board size per thread, since an engine's buffers are reused between calls
+_engines = threading.local()
+
+def get_engine(board_size):
+    """Returns this thread's PlayoutEngine for the given board size"""
+
+    if not hasattr(_engines, "by_size"):
+        _engines.by_size = {}
+    if board_size not in _engines.by_size:
+        _engines.by_size[board_size] = PlayoutEngine(board_size)
+    return _engines.by_size[board_size]
+
+
+def random_playouts(state, count=1, record_moves=False):
+    """Plays count uniformly random games from state and returns the list of payoffs for player 0.
+    If record_moves is true, returns (payoffs, move lists) where each move list holds the actions
+    played in that game, as needed for AMAF."""
+
+    engine = get_engine(len(state.board()))
+    engine.load(state)
+
+    payoffs = []
+    move_lists = []
+    for i in range(count):
+        moves = [] if record_moves else None
+        payoffs.append(engine.play(moves))
+        if record_moves:
+            move_lists.append(moves)
+
+    if record_moves:
+        return payoffs, move_lists
+    return payoffs
+
+
+# lockstep_playouts finishes the last few unfinished games one at a time with a PlayoutEngine,
+# since a NumPy step costs about the same for a handful of rows as for hundreds
+LOCKSTEP_MIN_ROWS = 16
+
+if np is not None:
+    # Packs the nine cells on a line through a move into a 9-bit code, and for each code whether
+    # those cells hold five in a row
+    _LINE_BITS = 1 << np.arange(9)
+    _LINE_HAS_FIVE = np.array([any((code >> start) & 0b11111 == 0b11111 for start in range(5)) for code in range(512)])
+
+def lockstep_playouts(state, count, record_moves=False):
+    """Plays count uniformly random games from state at the same time, one game per row of a
+    NumPy array, and returns the list of payoffs for player 0.  Every ply picks a random legal
+    move for all unfinished rows at once and checks the lines through those moves for five.
+    If record_moves is true, returns (payoffs, move lists) like random_playouts."""
+
+    if np is None:
+        raise ImportError("lockstep_playouts requires numpy")
+
+    if state.is_terminal():
+        payoffs = [state.payoff()] * count
+        return (payoffs, [[] for i in range(count)]) if record_moves else payoffs
+
+    # Rows use the same flat bordered layout as PlayoutEngine
+    engine = get_engine(len(state.board()))
+    engine.load(state)
+    width = engine.width
+    cells = width * width
+    base = np.array(engine.base, dtype=np.int8)
+
+    # stones[player] has a True for each stone of that player; occupied also covers the border so
+    # that border cells are never legal.  All three are flat arrays of count rows of cells, so one
+    # index per row and cell can be used for gathers and scatters
+    stones = np.zeros((2, count * cells), dtype=bool)
+    stones[0] = np.tile(base == 0, count)
+    stones[1] = np.tile(base == 1, count)
+    occupied = np.tile(base != EMPTY, count)
+    legal = np.zeros((count, cells), dtype=bool)
+    legal[:, engine.base_frontier] = True
+    legal = legal.reshape(-1)
+
+    neighbor_offsets = np.array(engine.neighbor_offsets)
+    # The nine cells centered on a move along each line direction.  Indices past the edge of the
+    # board are clipped, which is safe because any window of five reaching them crosses the border
+    line_offsets = np.concatenate([d * np.arange(-4, 5) for d in engine.line_offsets])
+    cells_last = cells - 1
+    payoffs = np.zeros(count, dtype=np.int8)
+    moves = np.full((count, cells), -1, dtype=np.int32) if record_moves else None
+    active = np.arange(count)
+    player = state.actor()
+    ply = 0
+
+    while active.size > LOCKSTEP_MIN_ROWS:
+        starts = active * cells
+
+        # A uniformly random legal cell per row: the r-th legal cell for a random r below the count
+        totals = np.cumsum(legal.reshape(count, cells)[active], axis=1, dtype=np.int16)
+        r = (np.random.random(active.size) * totals[:, -1]).astype(np.int16)
+        idx = (totals > r[:, None]).argmax(axis=1)
+        flat = starts + idx
+        stones[player, flat] = True
+        occupied[flat] = True
+        legal[flat] = False
+        if record_moves:
+            moves[active, ply] = idx
+
+        # Five in a row must go through the new stone, so only test the five windows of five on
+        # each of the four lines through it
+        line = stones[player, starts[:, None] + (idx[:, None] + line_offsets).clip(0, cells_last)]
+        won = _LINE_HAS_FIVE[line.reshape(active.size, 4, 9) @ _LINE_BITS].any(axis=1)
+        payoffs[active[won]] = 1 if player == 0 else -1
+
+        # Empty neighbors of the new stones become legal
+        around = flat[:, None] + neighbor_offsets
+        opened = ~occupied[around]
+        legal[around] |= opened
+
+        # Rows with a win or without legal moves (a draw) are finished
+        stuck = (totals[:, -1] == 1) & ~opened.any(axis=1)
+        active = active[~(won | stuck)]
+        player = 1 - player
+        ply += 1
+
+    payoffs = payoffs.tolist()
+    actions = engine.actions
+    move_lists = [[actions[i] for i in row[:ply] if i >= 0] for row in moves.tolist()] if record_moves else None
+
+    # Play out the remaining rows from where they stopped
+    for row in active.tolist():
+        cells_row = base.tolist()
+        for i in np.flatnonzero(stones[0, row * cells:(row + 1) * cells]).tolist():
+            cells_row[i] = 0
+        for i in np.flatnonzero(stones[1, row * cells:(row + 1) * cells]).tolist():
+            cells_row[i] = 1
+        engine.load_cells(cells_row, player)
+        payoffs[row] = engine.play(move_lists[row] if record_moves else None)
+
+    if record_moves:
+        return payoffs, move_lists
+    return payoffs
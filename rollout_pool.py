@@ -0,0 +1,110 @@
+import os
+import random
+from array import array
+import multiprocessing
+import concurrent.futures
+
+from playout import get_engine, BORDER
+
+# A pool of worker processes that play random rollouts for the enhanced MCTS agents, started once
+# per process and reused for every leaf.  Positions are sent as bytes (one byte per cell) and each
+# worker plays a batch of rollouts per task, returning the moves of each as an array of 16-bit cell numbers.
+
+# Default number of worker processes, and rollouts played per leaf
+WORKERS = 4
+ROLLOUTS_PER_LEAF = 4
+
+# Process pools by number of workers, shared by the rollout pools and mcts_uct0's root parallel
+# search and kept for the whole run so that workers are only started once
+_executors = {}
+
+def make_executor(workers):
+    """Returns a new process pool with the given number of workers"""
+
+    # fork where available, so workers start quickly with the modules already imported
+    context = multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods() else None)
+    return concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context)
+
+
+def get_executor(workers):
+    """Returns this process's process pool with the given number of workers, starting it if needed"""
+
+    if workers not in _executors:
+        _executors[workers] = make_executor(workers)
+    return _executors[workers]
+
+
+def shutdown():
+    """Shuts down every process pool started by get_executor and forgets the rollout pools on them"""
+
+    for executor in _executors.values():
+        executor.shutdown()
+    _executors.clear()
+    _pools.clear()
+
+
+def encode(state):
+    """Returns (board size, player to move, cells) for a nonterminal state, where cells holds one
+    byte per cell in row-major order: 0 for empty, 1 and 2 for the stones of players 0 and 1"""
+
+    board = state.board()
+    return len(board), state.actor(), bytes(space + 1 for row in board for space in row)
+
+
+def play_batch(board_size, turn, cells, count, seed):
+    """Plays count random rollouts from an encoded position in a worker process.  Returns the list
+    of payoffs for player 0 and, for each rollout, its moves as an array of x * board size + y."""
+
+    random.seed(seed)
+    engine = get_engine(board_size)
+    width = engine.width
+    bordered = [BORDER] * (width * width)
+    for x in range(board_size):
+        row = cells[x * board_size:(x + 1) * board_size]
+        bordered[(x + 1) * width + 1:(x + 1) * width + 1 + board_size] = [space - 1 for space in row]
+    engine.load_cells(bordered, turn)
+
+    payoffs = []
+    move_lists = []
+    for i in range(count):
+        moves = []
+        payoffs.append(engine.play(moves))
+        move_lists.append(array('H', [x * board_size + y for x, y in moves]))
+    return payoffs, move_lists
+
+
+class RolloutPool:
+    """Process pool that plays the rollouts for a leaf in batches, one batch per worker"""
+
+    def __init__(self, workers=WORKERS):
+        self.workers = workers
+        self.executor = get_executor(workers)
+
+    def playouts(self, state, count):
+        """Plays count random rollouts from a nonterminal state on the workers.
+        Returns (payoffs, move lists) in the same form as playout.random_playouts with record_moves."""
+
+        board_size, turn, cells = encode(state)
+        batches = min(self.workers, count)
+        futures = [self.executor.submit(play_batch, board_size, turn, cells, count // batches + (i < count % batches),
+                                        os.urandom(16))
+                   for i in range(batches)]
+
+        payoffs = []
+        move_lists = []
+        for future in futures:
+            batch_payoffs, batch_moves = future.result()
+            payoffs.extend(batch_payoffs)
+            move_lists.extend([divmod(move, board_size) for move in moves] for moves in batch_moves)
+        return payoffs, move_lists
+
+
+# One pool per number of workers in this process
+_pools = {}
+
+def get_pool(workers=WORKERS):
+    """Returns this process's RolloutPool with the given number of workers, starting it if needed"""
+
+    if workers not in _pools:
+        _pools[workers] = RolloutPool(workers)
+    return _pools[workers]
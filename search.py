@@ -0,0 +1,139 @@
+import time
+
+# Number of killer moves remembered for each ply
+KILLERS_PER_PLY = 2
+
+# Half width of the aspiration window around the value from an earlier iteration
+ASPIRATION_WINDOW = 250
+
+# Late move reductions: at nodes searched to at least LMR_MIN_DEPTH, quiet moves after the first
+# LMR_FULL_MOVES are searched one ply shallower first
+LMR_MIN_DEPTH = 3
+LMR_FULL_MOVES = 3
+
+# Top-K pruning, when turned on, only applies to nodes searched to at least this depth
+TOP_K_MIN_DEPTH = 2
+
+# Nodes searched between checks of the clock, so the deadline costs little to enforce
+NODES_PER_CHECK = 256
+
+
+class SearchTimeout(Exception):
+    """Raised inside alphabeta when a search runs past its deadline"""
+
+
+class Search:
+    """Tables and counters shared by the nodes of the alpha-beta searches for one move: the
+    transposition table, the killer moves and history scores used to order moves, and the number
+    of nodes searched.  Killer moves are kept per ply, counted as stones on the board, so they
+    carry over from one iteration of iterative deepening to the next.  Once a deadline (a
+    time.time() value) is set, alphabeta stops the search by calling check_time every
+    NODES_PER_CHECK nodes, which raises SearchTimeout after the deadline."""
+
+    def __init__(self, table=None, ordering=True, deadline=None, pvs=True, aspiration=ASPIRATION_WINDOW,
+                 lmr=True, top_k=None):
+        self.table = table
+        self.ordering = ordering
+        self.deadline = deadline
+        # principal variation search, and the aspiration window half width (None for a full window)
+        self.pvs = pvs
+        self.aspiration = aspiration
+        # late move reductions, and the number of quiet moves to keep at each node (None for all)
+        self.lmr = lmr
+        self.top_k = top_k
+        # ply -> moves that caused a cutoff at that ply, most recent first
+        self.killers = {}
+        # per player, action -> sum of depth squared over the cutoffs it caused
+        self.history = [{}, {}]
+        self.nodes = 0
+        # null window searches that failed high and were searched again with the full window
+        self.researches = 0
+        # moves searched at reduced depth, the ones of those searched again at full depth, and
+        # quiet moves left out by top-K pruning
+        self.reductions = 0
+        self.reduction_researches = 0
+        self.pruned = 0
+        # depth in plies of the last completed iteration
+        self.depth = 0
+        self.next_check = NODES_PER_CHECK
+
+    def check_time(self):
+        """Raises SearchTimeout if the deadline has passed, and sets when to check again"""
+
+        self.next_check = self.nodes + NODES_PER_CHECK
+        if self.deadline is not None and time.time() >= self.deadline:
+            raise SearchTimeout()
+
+    def order(self, pos, first=None):
+        """Returns the legal moves from pos, most promising first: the given move (from the
+        transposition table or the previous iteration), the killer moves for this ply, then the
+        rest by history score and then by number of adjacent stones.  Without ordering, returns
+        them in row-major order."""
+
+        actions = pos.get_actions()
+        if not self.ordering:
+            return actions
+
+        history = self.history[pos.actor()]
+        # stable, so moves with equal scores stay in row-major order
+        actions.sort(key=lambda action: (history.get(action, 0), pos.adjacent_stones(action)), reverse=True)
+
+        front = []
+        for action in (first,) + tuple(self.killers.get(pos.stones_played(), ())):
+            if action is not None and action not in front and pos.is_legal(action):
+                front.append(action)
+        if front:
+            actions = front + [action for action in actions if action not in front]
+        return actions
+
+    def select(self, pos, actions, evaluator, depth):
+        """Returns the moves from pos to search to depth, out of actions in search order, and the
+        set of them that may be searched at reduced depth.  A move is quiet if it changes the
+        heuristic by less than a three in a row is worth, so it neither makes a threat nor blocks
+        one.  Top-K pruning drops the quiet moves that do not gain the most for the player to
+        move, always keeping the first move; late move reductions apply to the quiet moves after
+        the first LMR_FULL_MOVES."""
+
+        reduce = self.lmr and depth >= LMR_MIN_DEPTH
+        prune = self.top_k is not None and depth >= TOP_K_MIN_DEPTH
+        if not (reduce or prune):
+            return actions, ()
+
+        player = pos.actor()
+        factor = 1 if player == 0 else -1
+        threshold = evaluator.table.weight_rows[2]
+        gains = {action: evaluator.gain(action, player) * factor for action in actions}
+        quiet = [action for action in actions[1:] if abs(gains[action]) < threshold]
+
+        if prune and len(quiet) > self.top_k:
+            dropped = set(sorted(quiet, key=lambda action: gains[action], reverse=True)[self.top_k:])
+            self.pruned += len(dropped)
+            actions = [action for action in actions if action not in dropped]
+            quiet = [action for action in quiet if action not in dropped]
+
+        if not reduce:
+            return actions, ()
+        late = set(actions[LMR_FULL_MOVES:])
+        return actions, {action for action in quiet if action in late}
+
+    def cutoff(self, pos, action, depth):
+        """Records that action caused a cutoff in a search of pos to depth"""
+
+        if not self.ordering:
+            return
+        ply = pos.stones_played()
+        killers = self.killers.setdefault(ply, [])
+        if action not in killers:
+            killers.insert(0, action)
+            del killers[KILLERS_PER_PLY:]
+        history = self.history[pos.actor()]
+        history[action] = history.get(action, 0) + depth * depth
+
+    def stats(self):
+        """Returns a one line summary of the search"""
+
+        summary = (f"depth {self.depth}, {self.nodes} nodes, {self.researches} re-searches, "
+                   f"{self.reductions} reduced ({self.reduction_researches} re-searched), {self.pruned} pruned")
+        if self.table is not None:
+            summary += f", table: {self.table.stats()}"
+        return summary
@@ -0,0 +1,126 @@
+from collections import OrderedDict
+
+# Bounded table for the implicit UCT2 tree of mcts_uct2: Zobrist key -> [total value, visits,
+# edge actions, edge successor keys, edge visits], the edges being arrays in get_actions() order.
+# Entries are kept in least recently visited order and the oldest are evicted once the table is
+# over its budget, except for the pinned entries (the root and the principal path below it), which
+# are kept however old they are.  Eviction only happens when evict is called, so that the entries
+# of a visit stay in place until it has been backed up.
+
+# Rough size in bytes of one entry (the list, its three arrays, its key and the table's slot for
+# it) and of each edge in its arrays, used to turn a memory cap into a number of entries
+ENTRY_BYTES = 450
+EDGE_BYTES = 14
+
+
+class StateTable:
+    """Dict-like table of UCT2 statistics, capped at max_entries entries and/or max_megabytes of
+    estimated memory (no cap if both are None).  Looking an entry up does not change its age;
+    touch marks it as recently used, so that scoring the siblings of a node does not keep them."""
+
+    def __init__(self, max_entries=None, max_megabytes=64):
+        self.max_entries = max_entries
+        self.max_bytes = None if max_megabytes is None else max_megabytes * 2 ** 20
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.pinned = set()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        if key in self.entries:
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def __getitem__(self, key):
+        return self.entries[key]
+
+    def touch(self, key):
+        """Marks the entry for key as recently used"""
+
+        self.entries.move_to_end(key)
+
+    def __setitem__(self, key, entry):
+        if key in self.entries:
+            self.bytes -= self.entry_bytes(self.entries[key])
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        self.bytes += self.entry_bytes(entry)
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def entry_bytes(entry):
+        """Returns the estimated memory taken by an entry"""
+
+        return ENTRY_BYTES + EDGE_BYTES * len(entry[2])
+
+    def over_budget(self):
+        return ((self.max_entries is not None and len(self.entries) > self.max_entries) or
+                (self.max_bytes is not None and self.bytes > self.max_bytes))
+
+    def evict(self):
+        """Removes least recently used entries that are not pinned until the table is within budget"""
+
+        # Pinned entries are moved to the newest end as they are passed; once every entry left has
+        # been passed over without an eviction, only pinned entries remain and they all stay
+        passed = 0
+        while self.over_budget() and passed < len(self.entries):
+            key, entry = self.entries.popitem(last=False)
+            if key in self.pinned:
+                self.entries[key] = entry
+                passed += 1
+            else:
+                self.bytes -= self.entry_bytes(entry)
+                self.evictions += 1
+                passed = 0
+
+    def principal_path(self, root_key):
+        """Returns the keys from root_key down the most visited edges, as far as they are in the table"""
+
+        path = [root_key]
+        seen = {root_key}
+        entry = self.entries.get(root_key)
+        while entry is not None:
+            children = [(visits, key) for key, visits in zip(entry[3], entry[4]) if visits > 0 and key in self.entries]
+            if not children:
+                break
+            key = max(children)[1]
+            if key in seen:
+                break
+            path.append(key)
+            seen.add(key)
+            entry = self.entries[key]
+        return path
+
+    def pin(self, root_key):
+        """Pins the root and the principal path below it, unpinning everything else"""
+
+        self.pinned = set(self.principal_path(root_key))
+
+    def clear(self):
+        """Removes every entry and resets the statistics"""
+
+        self.entries.clear()
+        self.bytes = 0
+        self.pinned = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def hit_rate(self):
+        """Returns the fraction of lookups that found an entry"""
+
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        """Returns a one line summary of the table's use"""
+
+        return (f"{len(self.entries)} entries ({self.bytes / 2 ** 20:.1f} MB estimated), {self.evictions} evictions, "
+                f"{100 * self.hit_rate():.1f}% hit rate")
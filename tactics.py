@@ -0,0 +1,56 @@
+from collections import Counter
+
+from threat_space import ThreatBoard
+
+# Moves that need no search, found from the number of stones each player has in every window of
+# five cells: make five, block the opponent's five, or make an open four.
+
+# How often tactics_policy answered each kind of move itself, and how often it passed the move on
+# to the wrapped policy ("searched"), over every policy it has wrapped
+COUNTS = Counter()
+
+
+def tactical_move(state):
+    """Returns (move, reason) if state has a move that does not need searching, where reason is
+    "win" for making five, "block" for stopping the opponent's five, or "open four" for making
+    two fives possible at once, and (None, None) otherwise"""
+
+    if state.is_terminal():
+        return None, None
+    board = ThreatBoard(state)
+    player = board.pos.actor()
+
+    fives = board.five_cells(player)
+    if fives:
+        return min(fives), "win"
+    # with more than one five to block the game is lost, but blocking one is still the best try
+    blocks = board.five_cells(1 - player)
+    if blocks:
+        return min(blocks), "block"
+    open_fours = board.open_four_cells(player)
+    if open_fours:
+        return min(open_fours), "open four"
+    return None, None
+
+
+def tactics_policy(policy):
+    """Wraps a policy (a function from a state to a move) so that moves found by tactical_move are
+    played without asking it, counting each outcome in COUNTS"""
+
+    def tactics(state):
+        action, reason = tactical_move(state)
+        if action is None:
+            COUNTS["searched"] += 1
+            return policy(state)
+        COUNTS[reason] += 1
+        return action
+    return tactics
+
+
+def summary():
+    """Returns a one line summary of COUNTS"""
+
+    total = sum(COUNTS.values())
+    fast = total - COUNTS["searched"]
+    return (f"tactics: {fast}/{total} moves without search ({COUNTS['win']} wins, "
+            f"{COUNTS['block']} blocks, {COUNTS['open four']} open fours)")
@@ -4,11 +4,16 @@ import gomoku
 import argparse
 import time
 import mcts_uct0
+import mcts_uct0_tree_parallel
+import mcts_soa
 import mcts_uct2
 import mcts_uct0_enhanced
 import mcts_uct2_enhanced
 import minimax
 import minimax_genetic
+import threat_space
+import tactics
+import rollout_pool
 import genetic
 
 
@@ -112,16 +117,32 @@ if __name__ == '__main__':
     parser.add_argument("p1_time", type=float, nargs='?', help="Maximum time for p1 mode", default=float('inf'))
     parser.add_argument("p2_time", type=float, nargs='?', help="Maximum time for p2 mode", default=float('inf'))
     parser.add_argument("random_prob", type=float, help="Probability of random move")
-    parser.add_argument("p1_mode", help="Player 1 mode", choices=['uct0', 'uct0_enhanced', 'uct2', 'uct2_enhanced', 'greedy', 'minimax', 'greedy_genetic', 'random'])
-    parser.add_argument("p2_mode", help="Player 2 mode", choices=['uct0', 'uct0_enhanced', 'uct2', 'uct2_enhanced', 'greedy', 'minimax', 'greedy_genetic', 'random'])
+    parser.add_argument("p1_mode", help="Player 1 mode", choices=['uct0', 'uct0_tree', 'uct0_soa', 'uct0_enhanced', 'uct2', 'uct2_enhanced', 'greedy', 'minimax', 'greedy_genetic', 'random'])
+    parser.add_argument("p2_mode", help="Player 2 mode", choices=['uct0', 'uct0_tree', 'uct0_soa', 'uct0_enhanced', 'uct2', 'uct2_enhanced', 'greedy', 'minimax', 'greedy_genetic', 'random'])
     parser.add_argument("--print_final", action='store_true', help="Print final board")
+    parser.add_argument("--bitboard", action='store_true', help="Use the bitboard state implementation")
+    parser.add_argument("--lockstep", type=int, default=None, help="Rollouts per leaf played at once with NumPy by the enhanced MCTS agents")
+    parser.add_argument("--top_k", type=int, default=None, help="Quiet moves searched at each minimax node, best by heuristic gain first")
+    parser.add_argument("--minimax_time", type=float, default=0.05, help="Time per move for minimax, which always searches to depth 2")
+    parser.add_argument("--report_depth", action='store_true', help="Print the depth minimax reaches for each move")
+    parser.add_argument("--threat_space", action='store_true', help="Play proven wins found by threat-space search before asking an agent for a move")
+    parser.add_argument("--tactics", action='store_true', help="Play wins, blocks of fives and open fours without asking an agent for a move")
+    parser.add_argument("--workers", type=int, default=1, help="Processes for uct0 (each growing its own tree from the root) and uct0_tree (all growing one tree)")
+    parser.add_argument("--rollouts", type=int, default=rollout_pool.ROLLOUTS_PER_LEAF, help="Rollouts per leaf played on the rollout pool by the enhanced MCTS agents")
+    parser.add_argument("--rollout_workers", type=int, default=rollout_pool.WORKERS, help="Processes in the rollout pool of the enhanced MCTS agents")
+    parser.add_argument("--no_reuse", action='store_true', help="Make uct0 and uct0_enhanced start a new tree for every move")
+    parser.add_argument("--report_reuse", action='store_true', help="Print the visits uct0 and uct0_enhanced inherit from their last search for each move")
+    parser.add_argument("--uct2_megabytes", type=float, default=64, help="Memory cap in megabytes for uct2's state table (0 for no cap)")
+    parser.add_argument("--report_table", action='store_true', help="Print the size, evictions and hit rate of uct2's state table after each move")
+    parser.add_argument("--state_free", action='store_true', help="Make uct0 store only the move in each node and replay moves on one board instead of keeping a state per node")
+    parser.add_argument("--widening", action='store_true', help="Make uct0 add children best first by heuristic, more as a node is visited, with the heuristic as a UCB prior")
     args = parser.parse_args()
 
-    if args.p1_mode == 'uct0' or args.p1_mode == 'uct0_enhanced' or args.p1_mode == 'uct2' or args.p1_mode == 'uct2_enhanced' or args.p1_mode == 'greedy_genetic':
+    if args.p1_mode == 'uct0' or args.p1_mode == 'uct0_tree' or args.p1_mode == 'uct0_soa' or args.p1_mode == 'uct0_enhanced' or args.p1_mode == 'uct2' or args.p1_mode == 'uct2_enhanced' or args.p1_mode == 'greedy_genetic':
         if args.p1_time == float('inf'):
             raise ValueError("p1_time is required for p1 mode")
 
-    if args.p2_mode == 'uct0' or args.p2_mode == 'uct0_enhanced' or args.p2_mode == 'uct2' or args.p2_mode == 'uct2_enhanced' or args.p2_mode == 'greedy_genetic':
+    if args.p2_mode == 'uct0' or args.p2_mode == 'uct0_tree' or args.p2_mode == 'uct0_soa' or args.p2_mode == 'uct0_enhanced' or args.p2_mode == 'uct2' or args.p2_mode == 'uct2_enhanced' or args.p2_mode == 'greedy_genetic':
         if (args.p1_mode == 'greedy' or args.p1_mode == 'minimax' or args.p1_mode == 'random') and args.p2_time == float('inf'):
             if args.p1_time == float('inf'):
                 raise ValueError("p2_time is required for p2 mode")
@@ -147,31 +168,41 @@ if __name__ == '__main__':
             if policy_name == "random":
                 policies[i] = lambda: random_choice
             elif policy_name == "uct0":
-                policies[i] = lambda max_time=max_time: mcts_uct0.mcts_policy(max_time)
+                policies[i] = lambda max_time=max_time: mcts_uct0.mcts_policy(max_time, args.workers, not args.no_reuse, args.report_reuse, args.state_free, args.widening)
+            elif policy_name == "uct0_tree":
+                policies[i] = lambda max_time=max_time: mcts_uct0_tree_parallel.mcts_policy(max_time, args.workers)
+            elif policy_name == "uct0_soa":
+                policies[i] = lambda max_time=max_time: mcts_soa.mcts_policy(max_time)
             elif policy_name == "uct0_enhanced":
-                policies[i] = lambda max_time=max_time: mcts_uct0_enhanced.mcts_policy(max_time)
+                policies[i] = lambda max_time=max_time: mcts_uct0_enhanced.mcts_policy(max_time, args.lockstep, args.rollouts, args.rollout_workers, not args.no_reuse, args.report_reuse)
             elif policy_name == "uct2":
-                policies[i] = lambda max_time=max_time: mcts_uct2.mcts_policy(max_time)
+                policies[i] = lambda max_time=max_time: mcts_uct2.mcts_policy(max_time, args.uct2_megabytes or None, report=args.report_table)
             elif policy_name == "uct2_enhanced":
-                policies[i] = lambda max_time=max_time: mcts_uct2_enhanced.mcts_policy(max_time)
+                policies[i] = lambda max_time=max_time: mcts_uct2_enhanced.mcts_policy(max_time, args.lockstep, args.rollouts, args.rollout_workers)
             elif policy_name == "greedy":
                 policies[i] = lambda: minimax.greedy_policy()
             elif policy_name == "minimax":
-                # 0.05 to always search to depth 2
-                policies[i] = lambda: minimax.minimax_policy(0.05)
+                # its own time per move, so p1_time and p2_time stay the times of the other agents
+                policies[i] = lambda: minimax.minimax_policy(args.minimax_time, args.top_k, args.report_depth)
             elif policy_name == "greedy_genetic":
                 weights = genetic.generate_weights(max_time)
                 print(f"Best Weights: {weights}")
                 policies[i] = lambda: minimax_genetic.greedy_policy(weights[0], weights[1])
             else:
                 raise ValueError
+            if args.threat_space and policy_name != "random":
+                policies[i] = lambda make_policy=policies[i]: threat_space.solver_policy(make_policy())
+            if args.tactics and policy_name != "random":
+                policies[i] = lambda make_policy=policies[i]: tactics.tactics_policy(make_policy())
         print_final = args.print_final
     except ValueError:
         print("Invalid argument type")
         sys.exit(1)
     try:
-        game = Gomoku(11)
+        game = Gomoku(11, args.bitboard)
         test_game(game, count, random_prob, policies[0], policies[1], max_time, float("inf"), print_final)
+        if args.tactics:
+            print(tactics.summary())
         sys.exit(0)
     except MCTSTestError as err:
         print(sys.argv[0] + ":", str(err))
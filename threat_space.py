@@ -0,0 +1,306 @@
+import time
+
+# Threat-space search for Gomoku: proves a win for the player to move by playing only threats
+# (fours, and for VCT also threes) and following the defences that could stop them.  Positions are
+# tracked by counting each player's stones in every window of five cells, so fours and threes are
+# found by looking at the windows one player has three or four stones in and the other none.
+
+# Budgets for solve when none are given
+DEFAULT_MAX_DEPTH = 8
+DEFAULT_MAX_NODES = 20000
+
+# Budgets for solver_policy, kept small since they come on top of the wrapped policy's own time
+POLICY_MAX_NODES = 2000
+POLICY_MAX_TIME = 0.1
+
+# Nodes searched between checks of the clock
+NODES_PER_CHECK = 256
+
+# windows of five cells and the windows through each cell, cached by board size
+_WINDOWS = {}
+
+def _window_table(board_size):
+    """Returns (windows, cell windows) where windows is a list of tuples of five (x, y) cells in a
+    line and cell windows[x][y] lists the indices of the windows through (x, y)"""
+
+    if board_size not in _WINDOWS:
+        windows = []
+        for x in range(board_size):
+            for y in range(board_size):
+                for x_diff, y_diff in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                    end_x, end_y = x + 4 * x_diff, y + 4 * y_diff
+                    if 0 <= end_x < board_size and 0 <= end_y < board_size:
+                        windows.append(tuple((x + i * x_diff, y + i * y_diff) for i in range(5)))
+        cell_windows = [[[] for y in range(board_size)] for x in range(board_size)]
+        for index, window in enumerate(windows):
+            for x, y in window:
+                cell_windows[x][y].append(index)
+        _WINDOWS[board_size] = (windows, cell_windows)
+    return _WINDOWS[board_size]
+
+
+class ThreatBoard:
+    """A Gomoku.Position together with the number of stones each player has in every window of
+    five cells.  open[player][k] is the set of windows holding k stones of player and none of the
+    other player, kept up to date for k from 2 to 4 as moves are played and undone."""
+
+    def __init__(self, state):
+        self.pos = state.position()
+        board = self.pos.board()
+        self.board_size = len(board)
+        self.windows, self.cell_windows = _window_table(self.board_size)
+        self.counts = [[0] * len(self.windows) for player in range(2)]
+        # stones of player in each window if the other player has none there, otherwise 0
+        self.levels = [[0] * len(self.windows) for player in range(2)]
+        self.open = [{2: set(), 3: set(), 4: set()} for player in range(2)]
+        for index, window in enumerate(self.windows):
+            for x, y in window:
+                if board[x][y] != -1:
+                    self.counts[board[x][y]][index] += 1
+            self._classify(index)
+
+    def _classify(self, index):
+        counts = self.counts
+        for player in (0, 1):
+            old = self.levels[player][index]
+            new = counts[player][index] if counts[1 - player][index] == 0 else 0
+            if new != old:
+                self.levels[player][index] = new
+                by_level = self.open[player]
+                if old > 1:
+                    by_level[old].discard(index)
+                if 1 < new < 5:
+                    by_level[new].add(index)
+
+    def play(self, action):
+        """Plays action for the player to move"""
+
+        player = self.pos.actor()
+        self.pos.play(action)
+        self._update(action, player, 1)
+
+    def undo(self):
+        """Takes back the last move played"""
+
+        action = self.pos.last_action()
+        self.pos.undo()
+        self._update(action, self.pos.actor(), -1)
+
+    def _update(self, action, player, change):
+        x, y = action
+        counts = self.counts[player]
+        for index in self.cell_windows[x][y]:
+            counts[index] += change
+            # only the count of this window changed, so only it needs classifying again
+            self._classify(index)
+
+    def _empty_cells(self, windows):
+        board = self.pos.board()
+        return {(x, y) for index in windows for x, y in self.windows[index] if board[x][y] == -1}
+
+    def five_cells(self, player):
+        """Returns the set of cells where player would make five in a row"""
+
+        return self._empty_cells(self.open[player][4])
+
+    def four_moves(self, player):
+        """Returns the set of legal cells where player would make a four (a window of five with four
+        of player's stones and an empty cell)"""
+
+        return {action for action in self._empty_cells(self.open[player][3]) if self.pos.is_legal(action)}
+
+    def open_four_cells(self, player):
+        """Returns a dict from each legal cell where player, to move, would make two or more fives
+        possible at once (an open four or a double four) to the set of those five cells"""
+
+        board = self.pos.board()
+        cells = {}
+        for action in self._empty_cells(self.open[player][3]):
+            if not self.pos.is_legal(action):
+                continue
+            # the windows through action that it would turn into fours, and the cells they need
+            x, y = action
+            fives = set()
+            for index in self.cell_windows[x][y]:
+                if index in self.open[player][3]:
+                    fives |= {(f_x, f_y) for f_x, f_y in self.windows[index] if (f_x, f_y) != action and board[f_x][f_y] == -1}
+            if len(fives) >= 2:
+                cells[action] = fives
+        return cells
+
+    def three_moves(self, player):
+        """Returns the set of legal cells where player, to move, would make a three: a position
+        from which player, moving again, could make an open four"""
+
+        moves = set()
+        fours = self.four_moves(player)
+        for action in self._empty_cells(self.open[player][2]):
+            if action in fours or not self.pos.is_legal(action):
+                continue
+            self.play(action)
+            if self.open_four_cells(player):
+                moves.add(action)
+            self.undo()
+        return moves
+
+    def three_defences(self, player):
+        """Returns the set of legal cells where the other player could stop the threes of player:
+        the cells where player would make an open four, and the cells those fours would need"""
+
+        defences = set()
+        for action, fives in self.open_four_cells(player).items():
+            defences.add(action)
+            defences |= {cell for cell in fives if self.pos.is_legal(cell)}
+        return defences
+
+
+class _BudgetExceeded(Exception):
+    pass
+
+
+class ThreatSolver:
+    """Searches for a forced win for the player to move in a Gomoku.State or Gomoku.Position using
+    only threats.  The attacker plays fours (VCF, victory by continuous fours) and, if vct is set,
+    threes too (VCT, victory by continuous threats).  After a four the defender has to block; after
+    a three the defender may block at any cell that stops the open four or make a four of their
+    own.  A line is only returned if it wins against every defence."""
+
+    def __init__(self, max_depth=DEFAULT_MAX_DEPTH, max_nodes=DEFAULT_MAX_NODES, max_time=None, vct=True):
+        self.max_depth = max_depth
+        self.max_nodes = max_nodes
+        self.max_time = max_time
+        self.vct = vct
+        self.nodes = 0
+
+    def solve(self, state):
+        """Returns a winning line for the player to move (the attacker's moves and the defender's
+        replies, starting with the attacker's move), or None if no win was proven within the
+        budget"""
+
+        if state.is_terminal():
+            return None
+        self.board = ThreatBoard(state)
+        self.attacker = self.board.pos.actor()
+        self.nodes = 0
+        self.deadline = None if self.max_time is None else time.time() + self.max_time
+        # key -> greatest depth the attacker was shown not to win within, for VCF and VCT
+        self.failed = {}
+        try:
+            # continuous fours first, since they are much cheaper to search than threes
+            for vct in ((False, True) if self.vct else (False,)):
+                for depth in range(1, self.max_depth + 1):
+                    line = self._attack(depth, vct)
+                    if line is not None:
+                        return line
+        except _BudgetExceeded:
+            pass
+        return None
+
+    def _count_node(self):
+        self.nodes += 1
+        if self.nodes >= self.max_nodes:
+            raise _BudgetExceeded()
+        if self.deadline is not None and self.nodes % NODES_PER_CHECK == 0 and time.time() >= self.deadline:
+            raise _BudgetExceeded()
+
+    def _attack(self, depth, vct):
+        """Attacker to move with depth threats left: returns a winning line or None"""
+
+        self._count_node()
+        board = self.board
+        attacker = self.attacker
+        if board.pos.is_terminal():
+            return None
+        fives = board.five_cells(attacker)
+        if fives:
+            return [min(fives)]
+        defender_fives = board.five_cells(1 - attacker)
+        if len(defender_fives) > 1:
+            return None
+
+        key = (board.pos.key, vct)
+        if self.failed.get(key, -1) >= depth:
+            return None
+
+        if defender_fives:
+            # the defender's four has to be blocked, threat or not
+            candidates = list(defender_fives)
+        elif depth == 0:
+            candidates = []
+        else:
+            fours = board.four_moves(attacker)
+            candidates = sorted(fours)
+            if vct:
+                candidates += sorted(board.three_moves(attacker) - fours)
+
+        for action in candidates:
+            board.play(action)
+            line = self._defend(depth - 1 if not defender_fives else depth, vct)
+            board.undo()
+            if line is not None:
+                return [action] + line
+
+        self.failed[key] = depth
+        return None
+
+    def _defend(self, depth, vct):
+        """Defender to move after an attacker's move: returns a winning line for the attacker
+        against every defence, or None"""
+
+        self._count_node()
+        board = self.board
+        attacker = self.attacker
+        defender = 1 - attacker
+        if board.pos.is_terminal():
+            return [] if board.pos.winner == attacker else None
+        if board.five_cells(defender):
+            return None
+
+        fives = board.five_cells(attacker)
+        if len(fives) >= 2:
+            # an open four or a double four: block one and the attacker plays the other
+            first, second = sorted(fives)[:2]
+            return [first, second]
+        if fives:
+            defences = fives
+        elif vct and depth > 0:
+            defences = board.three_defences(attacker)
+            if not defences:
+                return None
+            defences |= board.four_moves(defender)
+        else:
+            return None
+
+        line = None
+        for action in sorted(defences):
+            board.play(action)
+            reply = self._attack(depth, vct)
+            board.undo()
+            if reply is None:
+                return None
+            if line is None:
+                line = [action] + reply
+        return line
+
+
+def solve(state, max_depth=DEFAULT_MAX_DEPTH, max_nodes=DEFAULT_MAX_NODES, max_time=None, vct=True):
+    """Returns a proven winning line for the player to move in state, or None if unknown"""
+
+    return ThreatSolver(max_depth, max_nodes, max_time, vct).solve(state)
+
+
+def winning_move(state, max_depth=DEFAULT_MAX_DEPTH, max_nodes=DEFAULT_MAX_NODES, max_time=None, vct=True):
+    """Returns the first move of a proven win for the player to move in state, or None"""
+
+    line = solve(state, max_depth, max_nodes, max_time, vct)
+    return line[0] if line else None
+
+
+def solver_policy(policy, max_nodes=POLICY_MAX_NODES, max_time=POLICY_MAX_TIME, vct=True):
+    """Wraps a policy (a function from a state to a move) so that it plays a proven threat-space
+    win whenever one is found, and asks policy for a move otherwise"""
+
+    def solver(state):
+        action = winning_move(state, max_nodes=max_nodes, max_time=max_time, vct=vct)
+        return action if action is not None else policy(state)
+    return solver
@@ -0,0 +1,98 @@
+# Bound types for a stored value: the exact value of the position, or a bound on it from a search
+# that was cut off (LOWER after a beta cutoff, UPPER when no move reached alpha)
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+# Rough size of one stored entry in bytes (the entry tuple, its key and value, and the slot
+# pointing to it), used to turn a memory cap into a number of slots
+ENTRY_BYTES = 200
+
+
+class TranspositionTable:
+    """Bounded table of alpha-beta results keyed by the Zobrist key of a position.  Each slot has
+    two tiers: one keeps the entry from the deepest search (replaced only by an equal or deeper
+    search, or by any search once it is left over from an earlier move), the other always takes
+    the newest entry that did not go in the first.  Entries are (key, depth, value, bound, move)."""
+
+    def __init__(self, max_megabytes=32):
+        # Number of slots per tier, a power of two so the slot is the low bits of the key
+        slots = 1
+        while 2 * slots * 2 * ENTRY_BYTES <= max_megabytes * 2 ** 20:
+            slots *= 2
+        self.mask = slots - 1
+        self.deep = [None] * slots
+        self.recent = [None] * slots
+        # Search each deep entry was stored in, so entries from old searches can be replaced
+        self.deep_search = [0] * slots
+        self.search = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    def new_search(self):
+        """Marks the start of a search for a new move, which ages the entries already stored"""
+
+        self.search += 1
+
+    def clear(self):
+        """Removes every entry and resets the statistics"""
+
+        self.deep = [None] * len(self.deep)
+        self.recent = [None] * len(self.recent)
+        self.deep_search = [0] * len(self.deep)
+        self.search = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    def probe(self, key):
+        """Returns the entry stored for key, or None"""
+
+        slot = key & self.mask
+        entry = self.deep[slot]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry
+        entry = self.recent[slot]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        return None
+
+    def store(self, key, depth, value, bound, move):
+        """Stores the result of searching the position with the given key to depth"""
+
+        slot = key & self.mask
+        entry = (key, depth, value, bound, move)
+        self.stores += 1
+        deep = self.deep[slot]
+        # a shallower result for the position already in the deep tier goes to the recent tier, so
+        # the leaf stores that follow a deep search do not replace it
+        if deep is None or depth >= deep[1] or self.deep_search[slot] != self.search:
+            self.deep[slot] = entry
+            self.deep_search[slot] = self.search
+        else:
+            self.recent[slot] = entry
+
+    def __len__(self):
+        return sum(entry is not None for entry in self.deep) + sum(entry is not None for entry in self.recent)
+
+    def capacity(self):
+        """Returns the greatest number of entries the table can hold"""
+
+        return len(self.deep) + len(self.recent)
+
+    def hit_rate(self):
+        """Returns the fraction of probes that found an entry"""
+
+        probes = self.hits + self.misses
+        return self.hits / probes if probes else 0.0
+
+    def stats(self):
+        """Returns a one line summary of the table's use"""
+
+        return (f"{self.hits} hits, {self.misses} misses ({100 * self.hit_rate():.1f}% hit rate), "
+                f"{self.stores} stores, {len(self)}/{self.capacity()} entries")